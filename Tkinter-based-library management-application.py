@@ -1,95 +1,435 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import sqlite3
 from datetime import datetime, timedelta
-import os
+import argparse
+import sys
+import queue
+import threading
+import time
+
+from library_service import (BOOK_MATCH_LIMIT, COMPACT_BATCH_SIZE, CSV_COLUMNS,
+                             CSV_IMPORT_TABLES, DATABASE_PATH, DATE_FORMAT, DEFAULT_DESK,
+                             DISPLAY_DATE_FORMAT, FINE_PER_DAY,
+                             ID_ORDER, NO_SEARCH, SEARCH_COUNT_LIMIT, LibraryError,
+                             LibraryService, LoanOrder, build_search, check_stats,
+                             connect_database, export_csv, import_csv, order_position,
+                             rebuild_stats, seed_database, to_display_date)
+from library_instrumentation import Instrumentation
+from library_notices import (DUE_SOON_DAYS, NOTICE_DOMAIN, NOTICE_KINDS, NOTICE_SENDER,
+                             DirectorySpool, MboxSpool, write_notices)
+
+# tkcalendar is slow to import, so the date pickers replace the plain date entries
+# only after the window has first been drawn (see load_date_picker)
+DateEntry = None
+
+# Virtual table settings: only the visible rows plus a buffer are materialized
+TABLE_ROW_HEIGHT = 20
+TABLE_HEADER_HEIGHT = 25
+TABLE_PAGE_BUFFER = 30
+
+# Table columns that sort the table when their heading is clicked (LOAN_ORDERS names)
+TABLE_SORT_ORDERS = {'ID': 'id', 'Student': 'student', 'Book': 'book',
+                     'Borrow Date': 'borrow_date', 'Return Date': 'return_date', 'Fine': 'fine'}
+
+# Search settings
+SEARCH_DEBOUNCE_MS = 150
+
+# Database worker settings
+WORKER_POLL_MS = 15
+WORKER_PROGRESS_STEPS = 1000
+
+# Returned loans are moved to the loan history in the background
+COMPACT_INTERVAL_MS = 60000
+
+# Circulation figures are re-read this often to pick up other desks' changes;
+# while the periodic read fails it backs off, doubling up to the maximum
+STATS_REFRESH_MS = 5000
+STATS_REFRESH_MAX_MS = 60000
+
+# Profiling (--profile): Tk handlers that are timed, and the diagnostics refresh rate.
+# Handlers that end in a modal message box are left out, as they would time the user.
+UI_HANDLERS = ('search_records', 'schedule_search', 'schedule_book_search',
+               'refresh_books_combobox', 'show_available_books', 'refresh_table',
+               'show_record_count', 'rows_fetched', 'render_table', 'on_table_scroll',
+               'on_table_wheel', 'on_table_resize', 'on_tree_select', 'add_borrow_record',
+               'return_record', 'clear_form', 'update_fines', 'install_date_pickers',
+               'sort_table')
+DIAGNOSTICS_REFRESH_MS = 1000
+BATCH_UI_HANDLERS = ('scan', 'books_found', 'remove_selected', 'commit', 'checked_out')
+
+
+def load_date_picker():
+    """Import tkcalendar's DateEntry on first use; None if it is not installed"""
+    global DateEntry
+    if DateEntry is None:
+        try:
+            from tkcalendar import DateEntry
+        except ImportError:
+            DateEntry = False
+            print("tkcalendar not available. Using simple date entry.")
+    return DateEntry or None
+
 
-# Try to import tkcalendar, provide fallback if not available
-try:
-    from tkcalendar import DateEntry
+class DatabaseWorker:
+    """Run all SQLite work on one background thread so the Tk mainloop never blocks.
 
-    TK_CALENDAR_AVAILABLE = True
-except ImportError:
-    TK_CALENDAR_AVAILABLE = False
-    print("tkcalendar not available. Using simple date entry.")
+    Jobs are plain functions taking the worker's LibraryService. Their results
+    are handed back to callbacks on the Tk thread by a short root.after poll.
+    """
+
+    def __init__(self, root, connect, instrumentation=None):
+        self.root = root
+        self.instrumentation = instrumentation
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, args=(connect,), daemon=True)
+        self.thread.start()
+        self.poll_id = self.root.after(WORKER_POLL_MS, self.poll)
+
+    def submit(self, work, callback=None, errback=None, cancelled=None):
+        """Queue work(service) on the worker thread.
+
+        callback(result) or errback(error) runs later on the Tk thread. If
+        cancelled() becomes true the job is skipped, or interrupted if it is
+        already running, and neither callback is called.
+        """
+        queued = time.perf_counter() if self.instrumentation else None
+        self.jobs.put((work, callback, errback, cancelled, queued))
+
+    def run(self, connect):
+        """Worker thread: own the service and its connection and execute jobs in order"""
+        try:
+            service = connect()
+        except Exception as e:
+            service = None
+            startup_error = e
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            work, callback, errback, cancelled, queued = job
+            if queued is not None:
+                self.instrumentation.record('worker', 'queue wait', time.perf_counter() - queued)
+            if cancelled and cancelled():
+                continue
+
+            if service is None:
+                self.results.put((errback, startup_error))
+                continue
+
+            # Let SQLite abort a running query as soon as it is superseded
+            if cancelled:
+                service.conn.set_progress_handler(lambda: 1 if cancelled() else 0,
+                                                  WORKER_PROGRESS_STEPS)
+            try:
+                self.results.put((callback, work(service)))
+            except Exception as e:
+                service.conn.rollback()
+                if not (cancelled and cancelled()):
+                    self.results.put((errback, e))
+            finally:
+                service.conn.set_progress_handler(None, 0)
+
+        if service is not None:
+            service.close()
+
+    def poll(self):
+        """Deliver finished jobs to their callbacks on the Tk thread"""
+        # Schedule the next poll first: a failing callback must not stop delivery
+        self.poll_id = self.root.after(WORKER_POLL_MS, self.poll)
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if callback:
+                try:
+                    callback(value)
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+
+    def close(self):
+        """Stop the worker after the queued jobs and close its connection"""
+        self.root.after_cancel(self.poll_id)
+        self.jobs.put(None)
+        self.thread.join(timeout=5)
+
+
+class BatchCheckout:
+    """Non-modal window that checks a basket of scanned books out to one student.
+
+    A barcode scanner types a book id followed by Enter. Each scan is checked
+    at once against cached stock, so scanning never waits for the database;
+    ids not cached yet are looked up together in the background. Problems are
+    shown in a status line instead of message boxes, and the whole basket is
+    committed in one transaction followed by one table update.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.stock = {}  # book id -> (title, quantity) as last read, None if unknown
+        self.basket = []  # accepted book ids in scan order; an id repeats per copy
+        self.pending = []  # scanned ids waiting for their lookup
+        self.looking_up = False
+        self.committing = False
+
+        # Time the handlers before they are bound to widgets
+        if app.instrumentation:
+            app.instrumentation.instrument_handlers(self, BATCH_UI_HANDLERS)
+
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Batch Checkout")
+        self.window.geometry("420x480")
+        frame = ttk.Frame(self.window, padding="15")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        # Student Name and Return Date, taken from the main form
+        ttk.Label(frame, text="Student Name:").grid(row=0, column=0, sticky=tk.W, pady=5)
+        self.student_var = tk.StringVar(value=app.student_name.get().strip())
+        ttk.Entry(frame, textvariable=self.student_var, width=30).grid(
+            row=0, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
+
+        ttk.Label(frame, text="Return Date:").grid(row=1, column=0, sticky=tk.W, pady=5)
+        self.return_var = tk.StringVar(value=app.get_date_from_widget(app.return_date))
+        ttk.Entry(frame, textvariable=self.return_var, width=20).grid(
+            row=1, column=1, sticky=tk.W, pady=5, padx=(10, 0))
+
+        # Scan field: one book id per line
+        ttk.Label(frame, text="Scan Book ID:").grid(row=2, column=0, sticky=tk.W, pady=5)
+        self.scan_var = tk.StringVar()
+        self.scan_entry = ttk.Entry(frame, textvariable=self.scan_var, width=30)
+        self.scan_entry.grid(row=2, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
+        self.scan_entry.bind('<Return>', self.scan)
+        self.scan_entry.bind('<KP_Enter>', self.scan)
+
+        # Basket
+        self.basket_list = tk.Listbox(frame, selectmode=tk.EXTENDED, height=12)
+        self.basket_list.grid(row=3, column=0, columnspan=2, sticky=(tk.N, tk.S, tk.W, tk.E),
+                              pady=5)
+        self.basket_list.bind('<Delete>', self.remove_selected)
+
+        self.status_label = tk.Label(frame, text="Scan books to fill the basket", anchor=tk.W,
+                                     font=('Arial', 10), fg='#333333')
+        self.status_label.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=5, column=0, columnspan=2, pady=(10, 0))
+
+        # Check Out Button (Green)
+        self.checkout_btn = tk.Button(button_frame, text="Check Out", command=self.commit,
+                                      bg='#4CAF50', fg='white', font=('Arial', 10, 'bold'),
+                                      width=10, cursor='hand2')
+        self.checkout_btn.grid(row=0, column=0, padx=5)
+
+        # Remove Button (Grey)
+        tk.Button(button_frame, text="Remove", command=self.remove_selected, bg='#757575',
+                  fg='white', font=('Arial', 10, 'bold'), width=10,
+                  cursor='hand2').grid(row=0, column=1, padx=5)
+
+        frame.columnconfigure(1, weight=1)
+        frame.rowconfigure(3, weight=1)
+        self.scan_entry.focus_set()
+
+    def show_status(self, text, error=False):
+        """Show feedback under the basket; errors also ring the bell"""
+        self.status_label.config(text=text, fg='#f44336' if error else '#333333')
+        if error:
+            self.window.bell()
+
+    def scan(self, event=None):
+        """Take one scanned book id from the scan field"""
+        text = self.scan_var.get().strip()
+        self.scan_var.set("")
+        if not text:
+            return 'break'
+        try:
+            book_id = int(text)
+        except ValueError:
+            self.show_status(f"Not a book id: {text}", error=True)
+            return 'break'
+
+        if self.committing:
+            self.show_status("Wait for the checkout to finish", error=True)
+        elif book_id in self.stock:
+            self.accept(book_id)
+        else:
+            self.pending.append(book_id)
+            self.look_up()
+        return 'break'
+
+    def look_up(self):
+        """Read the stock of every uncached scanned book in one background query"""
+        if self.looking_up or not self.pending:
+            return
+        book_ids = sorted(set(self.pending) - set(self.stock))
+        self.looking_up = True
+        self.app.db.submit(lambda service: service.get_books(book_ids),
+                           lambda books: self.books_found(book_ids, books),
+                           self.lookup_failed)
+
+    def books_found(self, book_ids, books):
+        """Cache the looked-up stock and check the scans that were waiting for it"""
+        self.looking_up = False
+        if not self.window.winfo_exists():
+            return
+        for book_id in book_ids:
+            self.stock[book_id] = None
+        for book_id, title, quantity in books:
+            self.stock[book_id] = (title, quantity)
+
+        pending, self.pending = self.pending, []
+        for book_id in pending:
+            if book_id in self.stock:
+                self.accept(book_id)
+            else:
+                self.pending.append(book_id)
+        self.look_up()
+
+    def lookup_failed(self, error):
+        """Drop the scans whose books could not be read"""
+        self.looking_up = False
+        self.pending = []
+        if self.window.winfo_exists():
+            self.show_status(f"Error looking up books: {str(error)}", error=True)
+
+    def accept(self, book_id):
+        """Add a scanned book to the basket if a copy is left for it"""
+        book = self.stock[book_id]
+        if book is None:
+            self.show_status(f"Unknown book id {book_id}", error=True)
+            return
+        title, quantity = book
+        if self.basket.count(book_id) >= quantity:
+            self.show_status(f"No copies left of {title}", error=True)
+            return
+        self.basket.append(book_id)
+        self.basket_list.insert(tk.END, f"{book_id}  {title}")
+        self.basket_list.see(tk.END)
+        self.show_status(f"{len(self.basket)} books in basket")
+
+    def remove_selected(self, event=None):
+        """Take the selected books out of the basket"""
+        if self.committing:
+            return
+        for index in reversed(self.basket_list.curselection()):
+            del self.basket[index]
+            self.basket_list.delete(index)
+        self.show_status(f"{len(self.basket)} books in basket")
+
+    def commit(self):
+        """Check the whole basket out in one transaction"""
+        if self.committing:
+            return
+        if self.pending:
+            self.show_status("Still looking up scanned books", error=True)
+            return
+
+        student_name = self.student_var.get().strip()
+        return_date = self.return_var.get().strip()
+        if not student_name:
+            self.show_status("Please enter student name", error=True)
+            return
+        if not self.basket:
+            self.show_status("The basket is empty", error=True)
+            return
+        if not self.app.validate_date(return_date):
+            self.show_status("Invalid return date format. Use MM/DD/YY", error=True)
+            return
+
+        borrow_dt = datetime.now().date()
+        return_dt = datetime.strptime(return_date, '%m/%d/%y').date()
+        book_ids = list(self.basket)
+        search = self.app.search
+        self.committing = True
+        self.checkout_btn.config(state=tk.DISABLED)
+        self.app.db.submit(lambda service: self.checkout_job(service, search, student_name,
+                                                              book_ids, borrow_dt, return_dt),
+                           lambda result: self.checked_out(student_name, search, *result),
+                           self.checkout_failed)
+
+    def checkout_job(self, service, search, student_name, book_ids, borrow_date, return_date):
+        """Worker job: commit the basket and check the new loans against the search"""
+        records = service.borrow_many(student_name, book_ids, borrow_date, return_date)
+        matches = [service.loan_matches_search(search, record[0]) for record in records]
+        return records, matches, service.get_books(sorted(set(book_ids)))
+
+    def checked_out(self, student_name, search, records, matches, books):
+        """Apply a committed basket to the main window and start a new basket"""
+        self.committing = False
+        self.app.update_book_availability(books)
+        self.app.table_records_added(records, search, matches)
+        self.app.refresh_stats()
+
+        if not self.window.winfo_exists():
+            return
+        for book_id, title, quantity in books:
+            self.stock[book_id] = (title, quantity)
+        self.basket = []
+        self.basket_list.delete(0, tk.END)
+        self.checkout_btn.config(state=tk.NORMAL)
+        self.show_status(f"Checked out {len(records)} books to {student_name}")
+        self.scan_entry.focus_set()
+
+    def checkout_failed(self, error):
+        """Keep the basket after a failed checkout so it can be corrected"""
+        self.committing = False
+        # Another desk may have taken copies; re-read the basket's stock on the next scan
+        for book_id in set(self.basket):
+            self.stock.pop(book_id, None)
+        self.app.refresh_books_combobox()
+
+        if not self.window.winfo_exists():
+            return
+        self.checkout_btn.config(state=tk.NORMAL)
+        if isinstance(error, LibraryError):
+            self.show_status(str(error), error=True)
+        else:
+            self.show_status(f"Error checking out: {str(error)}", error=True)
 
 
 class LibraryManagementApp:
-    def __init__(self, root):
+    def __init__(self, root, db_path=DATABASE_PATH, fine_rate=FINE_PER_DAY,
+                 instrumentation=None, desk=DEFAULT_DESK):
         self.root = root
+        self.fine_rate = fine_rate
+        self.instrumentation = instrumentation
         self.root.title("Library Management System")
         self.root.geometry("1200x700")
         self.root.configure(bg='#f0f0f0')
 
-        # Initialize database
-        self.init_database()
+        # Open database on the worker thread that owns the connection
+        self.db = DatabaseWorker(self.root,
+                                 lambda: self.open_service(db_path, fine_rate, desk),
+                                 instrumentation)
+
+        # Time the handlers before they are bound to widgets
+        if instrumentation:
+            instrumentation.instrument_handlers(self, UI_HANDLERS)
+            instrumentation.watch_event_loop(self.root)
 
         # Create GUI
         self.create_widgets()
 
-        # Load initial data
+        # Load initial data; the worker opens the database while the window is drawn
+        # and the table and book list fill in as their queries return
         self.refresh_books_combobox()
         self.refresh_table()
 
-    def init_database(self):
-        """Initialize database and create tables with sample data"""
-        # Remove existing database to start fresh (optional)
-        if os.path.exists('library.db'):
-            os.remove('library.db')
-
-        self.conn = sqlite3.connect('library.db')
-        self.cursor = self.conn.cursor()
-
-        # Create books table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                quantity INTEGER NOT NULL
-            )
-        ''')
-
-        # Create borrowed_books table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS borrowed_books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_name TEXT NOT NULL,
-                book_id INTEGER,
-                borrow_date TEXT NOT NULL,
-                return_date TEXT NOT NULL,
-                fine REAL DEFAULT 0,
-                FOREIGN KEY (book_id) REFERENCES books (id)
-            )
-        ''')
-
-        # Insert sample books
-        sample_books = [
-            ('Introduction to Python', 3),
-            ('Data Structures and Algorithms', 2),
-            ('Machine Learning Fundamentals', 4),
-            ('Database Systems', 1),
-            ('Web Development with Django', 2)
-        ]
-
-        self.cursor.executemany(
-            "INSERT INTO books (title, quantity) VALUES (?, ?)",
-            sample_books
-        )
-
-        # Insert sample borrowed records
-        sample_borrowed = [
-            ('John Smith', 1, '06/15/25', '06/25/25', 0),
-            ('Emma Wilson', 2, '06/18/25', '06/28/25', 0),
-            ('Michael Brown', 3, '06/10/25', '06/20/25', 25.0)
-        ]
-        self.cursor.executemany(
-            '''INSERT INTO borrowed_books 
-            (student_name, book_id, borrow_date, return_date, fine) 
-            VALUES (?, ?, ?, ?, ?)''',
-            sample_borrowed
-        )
-
-        self.conn.commit()
+        # Swap in the date pickers once the window is on screen
+        self.root.after_idle(lambda: self.root.after(0, self.install_date_pickers))
+
+        # Start archiving returned loans and keep the figures live
+        self.root.after(COMPACT_INTERVAL_MS, self.compact_loans)
+        self.poll_stats()
+
+    def open_service(self, db_path, fine_rate, desk):
+        """Open the worker's service, timing its queries when profiling"""
+        service = LibraryService.open(db_path, fine_rate, desk)
+        if self.instrumentation:
+            self.instrumentation.instrument_service(service)
+        return service
 
     def create_widgets(self):
         """Create all GUI widgets"""
@@ -126,31 +466,27 @@ class LibraryManagementApp:
 
         # Book Selection
         ttk.Label(form_frame, text="Book:").grid(row=1, column=0, sticky=tk.W, pady=8)
+        # Type-ahead: typing a title prefix lists the matching available books
         self.book_var = tk.StringVar()
-        self.book_combobox = ttk.Combobox(form_frame, textvariable=self.book_var,
-                                          state="readonly", width=27)
+        self.book_combobox = ttk.Combobox(form_frame, textvariable=self.book_var, width=27)
         self.book_combobox.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=8, padx=(10, 0))
-
-        # Borrow Date
+        self.book_combobox.bind('<KeyRelease>', self.schedule_book_search)
+        self.book_matches = []
+        self.books_dict = {}
+        self.book_prefix = None
+        self.book_search_version = 0
+        self.pending_book_search = None
+
+        # Borrow Date (a plain MM/DD/YY entry until the date picker is loaded)
         ttk.Label(form_frame, text="Borrow Date:").grid(row=2, column=0, sticky=tk.W, pady=8)
-
-        if TK_CALENDAR_AVAILABLE:
-            self.borrow_date = DateEntry(form_frame, width=18, background='darkblue',
-                                         foreground='white', borderwidth=2, date_pattern='mm/dd/y')
-        else:
-            self.borrow_date = ttk.Entry(form_frame, width=20)
-            self.borrow_date.insert(0, datetime.now().strftime('%m/%d/%y'))
+        self.borrow_date = ttk.Entry(form_frame, width=20)
+        self.borrow_date.insert(0, datetime.now().strftime('%m/%d/%y'))
         self.borrow_date.grid(row=2, column=1, sticky=tk.W, pady=8, padx=(10, 0))
 
         # Return Date
         ttk.Label(form_frame, text="Return Date:").grid(row=3, column=0, sticky=tk.W, pady=8)
-
-        if TK_CALENDAR_AVAILABLE:
-            self.return_date = DateEntry(form_frame, width=18, background='darkblue',
-                                         foreground='white', borderwidth=2, date_pattern='mm/dd/y')
-        else:
-            self.return_date = ttk.Entry(form_frame, width=20)
-            self.return_date.insert(0, datetime.now().strftime('%m/%d/%y'))
+        self.return_date = ttk.Entry(form_frame, width=20)
+        self.return_date.insert(0, datetime.now().strftime('%m/%d/%y'))
         self.return_date.grid(row=3, column=1, sticky=tk.W, pady=8, padx=(10, 0))
 
         # Configure column weights
@@ -172,11 +508,37 @@ class LibraryManagementApp:
                                     width=10, cursor='hand2')
         self.delete_btn.grid(row=0, column=1, padx=5, pady=5)
 
+        # Return Button (Orange)
+        self.return_btn = tk.Button(button_frame, text="Return", command=self.return_record,
+                                    bg='#FF9800', fg='white', font=('Arial', 10, 'bold'),
+                                    width=10, cursor='hand2')
+        self.return_btn.grid(row=1, column=0, padx=5, pady=5)
+
         # Clear Button (Grey)
         self.clear_btn = tk.Button(button_frame, text="Clear", command=self.clear_form,
                                    bg='#757575', fg='white', font=('Arial', 10, 'bold'),
                                    width=10, cursor='hand2')
-        self.clear_btn.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
+        self.clear_btn.grid(row=1, column=1, padx=5, pady=5)
+
+        # Update Fines Button (Blue)
+        self.fines_btn = tk.Button(button_frame, text="Update Fines", command=self.update_fines,
+                                   bg='#2196F3', fg='white', font=('Arial', 10, 'bold'),
+                                   width=10, cursor='hand2')
+        self.fines_btn.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+
+        # Batch Checkout Button (Purple), for barcode scanners
+        self.batch_btn = tk.Button(button_frame, text="Batch Checkout",
+                                   command=self.open_batch_checkout, bg='#9C27B0', fg='white',
+                                   font=('Arial', 10, 'bold'), width=14, cursor='hand2')
+        self.batch_btn.grid(row=3, column=0, columnspan=2, padx=5, pady=5)
+
+        # Diagnostics Button (Blue Grey), only when profiling
+        if self.instrumentation:
+            self.diagnostics_btn = tk.Button(button_frame, text="Diagnostics",
+                                             command=self.open_diagnostics, bg='#607D8B',
+                                             fg='white', font=('Arial', 10, 'bold'),
+                                             width=10, cursor='hand2')
+            self.diagnostics_btn.grid(row=4, column=0, columnspan=2, padx=5, pady=5)
 
     def create_books_table(self, parent):
         """Create the borrowed books table and search functionality"""
@@ -192,19 +554,26 @@ class LibraryManagementApp:
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=40)
         search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        search_entry.bind('<KeyRelease>', self.search_records)
+        search_entry.bind('<KeyRelease>', self.schedule_search)
 
         # Records count label
-        self.records_label = ttk.Label(search_frame, text="Records: 0")
+        self.records_label = ttk.Label(search_frame, text="Records: loading...")
         self.records_label.pack(side=tk.RIGHT, padx=(10, 0))
 
+        # Circulation figures (and those of the selected loan's student and book)
+        self.stats_label = ttk.Label(search_frame, text="")
+        self.stats_label.pack(side=tk.RIGHT, padx=(10, 0))
+        self.stats_selection = None  # (student name, book id) of the selected loan
+
         # Table with Scrollbar
         table_container = ttk.Frame(table_frame)
         table_container.pack(fill=tk.BOTH, expand=True)
 
-        # Create Treeview with scrollbar
-        columns = ('ID', 'Student', 'Book', 'Borrow Date', 'Return Date', 'Fine')
-        self.tree = ttk.Treeview(table_container, columns=columns, show='headings', height=15)
+        # Create Treeview with scrollbar. Rows use the loan id as their item id and
+        # carry the book id in a hidden column; several rows can be selected at once
+        columns = ('ID', 'Student', 'Book', 'Borrow Date', 'Return Date', 'Fine', 'Book ID')
+        self.tree = ttk.Treeview(table_container, columns=columns, show='headings', height=15,
+                                 displaycolumns=columns[:-1], selectmode='extended')
 
         # Define columns
         self.tree.heading('ID', text='ID')
@@ -214,6 +583,12 @@ class LibraryManagementApp:
         self.tree.heading('Return Date', text='Return Date')
         self.tree.heading('Fine', text='Fine (R)')
 
+        # Clicking a heading sorts the table by that column in the database
+        self.heading_texts = {}
+        for column in TABLE_SORT_ORDERS:
+            self.heading_texts[column] = self.tree.heading(column, 'text')
+            self.tree.heading(column, command=lambda column=column: self.sort_table(column))
+
         # Configure column widths
         self.tree.column('ID', width=50, anchor=tk.CENTER)
         self.tree.column('Student', width=150)
@@ -222,16 +597,37 @@ class LibraryManagementApp:
         self.tree.column('Return Date', width=100, anchor=tk.CENTER)
         self.tree.column('Fine', width=80, anchor=tk.CENTER)
 
-        # Create scrollbar
-        scrollbar = ttk.Scrollbar(table_container, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        # Create scrollbar (driven by the virtual table, not by the Treeview itself)
+        self.table_scrollbar = ttk.Scrollbar(table_container, orient=tk.VERTICAL,
+                                             command=self.on_table_scroll)
 
         # Grid treeview and scrollbar
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-        # Bind selection
+        self.table_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Virtual table state
+        self.visible_rows = 15
+        self.view_offset = 0
+        self.total_records = 0
+        self.page_cache = []
+        self.cache_offset = 0
+        self.row_items = {}  # borrowed_books.id -> (Treeview iid, shown record)
+        self.selected_book = None  # (book id, title) of the selected loan
+        self.cache_version = 0
+        self.fetch_pending = None
+        self.short_fetch_total = None  # total already recounted after a short fetch
+        self.table_version = 0
+        self.search = NO_SEARCH
+        self.order = ID_ORDER
+        self.last_search_text = ''
+        self.pending_search = None
+
+        # Bind selection, scrolling and resizing
         self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.tree.bind('<MouseWheel>', self.on_table_wheel)
+        self.tree.bind('<Button-4>', self.on_table_wheel)
+        self.tree.bind('<Button-5>', self.on_table_wheel)
+        self.tree.bind('<Configure>', self.on_table_resize)
 
         # Configure treeview style for colored header and rows
         self.configure_treeview_style()
@@ -241,6 +637,9 @@ class LibraryManagementApp:
         style = ttk.Style()
         style.theme_use('default')  # Use default theme for better customization
 
+        # Fixed row height so the virtual table knows how many rows fit
+        style.configure("Treeview", rowheight=TABLE_ROW_HEIGHT)
+
         # Configure heading style
         style.configure("Treeview.Heading",
                         background="#2196F3",
@@ -250,100 +649,417 @@ class LibraryManagementApp:
         # Create a custom tag for overdue records
         self.tree.tag_configure('overdue', background='#ffcccc')
 
+    def install_date_pickers(self):
+        """Replace the plain date entries with date pickers if tkcalendar is installed"""
+        if not load_date_picker():
+            return
+        for name in ('borrow_date', 'return_date'):
+            entry = getattr(self, name)
+            typed = entry.get()
+            placement = entry.grid_info()
+            picker = DateEntry(entry.master, width=18, background='darkblue',
+                               foreground='white', borderwidth=2, date_pattern='mm/dd/y')
+            entry.destroy()
+            picker.grid(**placement)
+            setattr(self, name, picker)
+            # Keep a date typed before the picker appeared
+            if self.validate_date(typed):
+                picker.set_date(datetime.strptime(typed, '%m/%d/%y'))
+
     def get_date_from_widget(self, widget):
         """Get date from widget whether it's DateEntry or regular Entry"""
-        if TK_CALENDAR_AVAILABLE and isinstance(widget, DateEntry):
+        if DateEntry and isinstance(widget, DateEntry):
             return widget.get_date().strftime('%m/%d/%y')
         else:
             return widget.get()
 
-    def refresh_books_combobox(self):
-        """Refresh the books combobox with available books"""
-        self.cursor.execute('''
-            SELECT id, title FROM books 
-            WHERE quantity > 0 
-            ORDER BY title
-        ''')
-        books = self.cursor.fetchall()
+    def set_date_in_widget(self, widget, stored_date):
+        """Show a stored YYYY-MM-DD date in a DateEntry or regular Entry"""
+        if DateEntry and isinstance(widget, DateEntry):
+            widget.set_date(datetime.strptime(stored_date, DATE_FORMAT))
+        else:
+            widget.delete(0, tk.END)
+            widget.insert(0, to_display_date(stored_date))
+
+    def report_error(self, message):
+        """Build an errback that shows a failed operation to the user"""
+        def show_error(error):
+            if isinstance(error, LibraryError):
+                messagebox.showerror("Error", str(error))
+            else:
+                messagebox.showerror("Error", f"{message}: {str(error)}")
+        return show_error
 
+    def refresh_books_combobox(self):
+        """Refresh the books combobox with the available books matching the typed prefix"""
+        self.pending_book_search = None
+        self.book_prefix = self.book_var.get().strip()
+        self.book_search_version += 1
+        version = self.book_search_version
+        prefix = self.book_prefix
+        self.db.submit(lambda service: service.search_books(prefix, BOOK_MATCH_LIMIT),
+                       lambda books: self.show_available_books(version, books),
+                       self.report_error("Error loading books"),
+                       cancelled=lambda: version != self.book_search_version)
+
+    def schedule_book_search(self, event=None):
+        """Debounce keystrokes in the book picker"""
+        # Ignore keys that did not change the text (arrows, shift, ...)
+        if self.book_var.get().strip() == self.book_prefix:
+            return
+        if self.pending_book_search is not None:
+            self.root.after_cancel(self.pending_book_search)
+        self.pending_book_search = self.root.after(SEARCH_DEBOUNCE_MS,
+                                                   self.refresh_books_combobox)
+
+    def show_available_books(self, version, books):
+        """Fill the books combobox once the matching books are loaded"""
+        if version != self.book_search_version:
+            return
+        self.book_matches = list(books)
+        self.update_book_choices()
+
+    def update_book_choices(self):
+        """Push the current matches into the combobox"""
         # Store book data for reference
-        self.books_dict = {title: book_id for book_id, title in books}
-
-        # Update combobox
-        self.book_combobox['values'] = [title for _, title in books]
-
-        if books:
-            self.book_combobox.set(books[0][1])
-        else:
-            self.book_var.set('')
+        self.books_dict = {title: book_id for book_id, title, _ in self.book_matches}
+        self.book_combobox['values'] = [title for _, title, _ in self.book_matches]
+
+    def update_book_availability(self, books):
+        """Apply some books' new quantities to the matches without reloading them"""
+        changed = {book[0]: book for book in books}
+        matches = [match for match in self.book_matches if match[0] not in changed]
+        prefix = (self.book_prefix or '').lower()
+        for book_id, title, quantity in changed.values():
+            if quantity > 0 and title.lower().startswith(prefix):
+                matches.append((book_id, title, quantity))
+        matches.sort(key=lambda match: (match[1].lower(), match[0]))
+        # Keep the list the same length as a fresh query would return
+        self.book_matches = matches[:BOOK_MATCH_LIMIT]
+        self.update_book_choices()
+
+    def find_book_id(self, book_title):
+        """Resolve the typed or chosen title to a book id from the current matches"""
+        # The book of the selected loan is known exactly, even if titles repeat
+        if self.selected_book and self.selected_book[1] == book_title:
+            return self.selected_book[0]
+        book_id = self.books_dict.get(book_title)
+        if book_id is None:
+            # Accept a full title typed in a different case
+            for match_id, title, _ in self.book_matches:
+                if title.lower() == book_title.lower():
+                    return match_id
+        return book_id
 
     def refresh_table(self):
-        """Refresh the table with current data"""
-        # Clear existing data
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # Fetch and display data
-        self.cursor.execute('''
-            SELECT bb.id, bb.student_name, b.title, bb.borrow_date, bb.return_date, bb.fine
-            FROM borrowed_books bb
-            JOIN books b ON bb.book_id = b.id
-            ORDER BY bb.id
-        ''')
-
-        records = self.cursor.fetchall()
-
-        # Insert data into treeview
-        for record in records:
-            item_id = self.tree.insert('', 'end', values=record)
-            # Highlight rows with fine > 0
-            if record[5] > 0:
-                self.tree.item(item_id, tags=('overdue',))
+        """Refresh the table with current data, keeping the scroll position"""
+        self.table_version += 1
+        version = self.table_version
+        search = self.search
+        self.db.submit(lambda service: service.count_loans(search),
+                       lambda total: self.show_record_count(version, total),
+                       self.report_error("Error loading records"),
+                       cancelled=lambda: version != self.table_version)
+
+    def show_record_count(self, version, total):
+        """Reset the table once the fresh record count arrives"""
+        if version != self.table_version:
+            return
+        self.total_records = total
+        self.page_cache = []
+        self.cache_offset = 0
+        self.cache_version += 1
+        self.render_table()
 
         # Update records count
-        self.records_label.config(text=f"Records: {len(records)}")
+        self.update_records_label()
 
     def search_records(self, event=None):
         """Filter table based on search text"""
-        search_text = self.search_var.get().lower()
-
-        # Clear current selection
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.pending_search = None
+        search_text = self.search_var.get().strip().lower()
+
+        # Ignore keys that did not change the text (arrows, shift, ...)
+        if search_text == self.last_search_text:
+            return
+        self.last_search_text = search_text
+        self.search = build_search(search_text)
+
+        # Start again from the top of the filtered results; a search that is
+        # still running for older text is interrupted by refresh_table()
+        self.view_offset = 0
+        self.refresh_table()
 
-        # Fetch and filter data
-        self.cursor.execute('''
-            SELECT bb.id, bb.student_name, b.title, bb.borrow_date, bb.return_date, bb.fine
-            FROM borrowed_books bb
-            JOIN books b ON bb.book_id = b.id
-            WHERE LOWER(bb.student_name) LIKE ? OR LOWER(b.title) LIKE ?
-            ORDER BY bb.id
-        ''', (f'%{search_text}%', f'%{search_text}%'))
+    def sort_table(self, column):
+        """Sort the table by a column; clicking the sorted column again reverses it"""
+        name = TABLE_SORT_ORDERS[column]
+        self.order = LoanOrder(name, self.order.name == name and not self.order.descending)
+        for heading, order_name in TABLE_SORT_ORDERS.items():
+            arrow = ''
+            if order_name == name:
+                arrow = ' \u25bc' if self.order.descending else ' \u25b2'
+            self.tree.heading(heading, text=self.heading_texts[heading] + arrow)
+
+        # Start again from the top in the new order
+        self.view_offset = 0
+        self.refresh_table()
 
-        records = self.cursor.fetchall()
+    def schedule_search(self, event=None):
+        """Debounce keystrokes so only the latest search text is queried"""
+        if self.pending_search is not None:
+            # A newer keystroke supersedes the search that has not run yet
+            self.root.after_cancel(self.pending_search)
+        self.pending_search = self.root.after(SEARCH_DEBOUNCE_MS, self.search_records)
+
+    def request_rows(self, start, end):
+        """Ask the database worker for the rows around [start, end) that are not cached"""
+        if self.fetch_pending == self.cache_version:
+            return  # render_table() runs again when the pending rows arrive
+
+        window_start = max(0, start - TABLE_PAGE_BUFFER)
+        window_end = min(self.total_records, end + TABLE_PAGE_BUFFER)
+        cache_end = self.cache_offset + len(self.page_cache)
+        search = self.search
+        order = self.order
+
+        if self.page_cache and self.cache_offset <= window_start <= cache_end:
+            # Scrolling down: keep the overlap and continue after the last cached record
+            kept = self.page_cache[window_start - self.cache_offset:]
+            last = order_position(order, self.page_cache[-1])
+            limit = window_end - window_start - len(kept)
+            work = lambda service: kept + service.fetch_loans(search, '>', last, limit,
+                                                              order=order)
+        elif self.page_cache and window_start < self.cache_offset <= window_end:
+            # Scrolling up: keep the overlap and continue before the first cached record
+            kept = self.page_cache[:window_end - self.cache_offset]
+            first = order_position(order, self.page_cache[0])
+            limit = self.cache_offset - window_start
+            work = lambda service: service.fetch_loans(search, '<', first, limit,
+                                                       descending=True, order=order) + kept
+        else:
+            # Jumped somewhere new: locate the first record once, then page from it
+            limit = window_end - window_start
+            work = lambda service: service.fetch_loans_from(search, window_start, limit, order)
+
+        version = self.cache_version
+        self.fetch_pending = version
+        self.db.submit(work,
+                       lambda rows: self.rows_fetched(version, window_start, window_end, rows),
+                       self.report_error("Error loading records"),
+                       cancelled=lambda: version != self.cache_version)
+
+    def rows_fetched(self, version, window_start, window_end, rows):
+        """Store freshly fetched rows in the page cache and show them"""
+        if version != self.cache_version:
+            return
+        self.fetch_pending = None
+
+        if len(rows) < window_end - window_start:
+            if self.short_fetch_total != self.total_records:
+                # Fewer rows than counted: the data changed underneath us, so recount
+                self.short_fetch_total = self.total_records
+                self.refresh_table()
+                return
+            # The recount came back the same, so another one would not help;
+            # end the table after the rows that do exist
+            self.total_records = window_start + len(rows)
+            self.update_records_label()
+        else:
+            self.short_fetch_total = None
+
+        self.page_cache = rows
+        self.cache_offset = window_start
+        self.cache_version += 1
+        self.render_table()
+
+    def render_table(self):
+        """Show the rows at the current scroll position, touching only rows that changed"""
+        self.view_offset = max(0, min(self.view_offset, self.total_records - self.visible_rows))
+        start = self.view_offset
+        end = min(start + self.visible_rows, self.total_records)
+
+        cache_end = self.cache_offset + len(self.page_cache)
+        if start < self.cache_offset or end > cache_end:
+            self.request_rows(start, end)
+            return
+        records = self.page_cache[start - self.cache_offset:end - self.cache_offset]
+
+        # Remove rows that scrolled out of view or no longer exist
+        visible_ids = {record[0] for record in records}
+        for loan_id in [loan_id for loan_id in self.row_items if loan_id not in visible_ids]:
+            item_id, _ = self.row_items.pop(loan_id)
+            self.tree.delete(item_id)
+
+        # Insert new rows at their index and update the ones already shown
+        for index, record in enumerate(records):
+            shown = self.row_items.get(record[0])
+            overdue = record[5] > 0
+            if shown is None:
+                # Highlight rows with fine > 0
+                item_id = self.tree.insert('', index, iid=str(record[0]),
+                                           values=self.display_values(record),
+                                           tags=('overdue',) if overdue else ())
+            else:
+                item_id, shown_record = shown
+                if shown_record != record:
+                    self.tree.item(item_id, values=self.display_values(record))
+                if (shown_record[5] > 0) != overdue:
+                    self.tree.item(item_id, tags=('overdue',) if overdue else ())
+            self.row_items[record[0]] = (item_id, record)
+
+        # Rows kept from before are out of place after a new sort or changed fines
+        item_ids = [self.row_items[record[0]][0] for record in records]
+        if list(self.tree.get_children()) != item_ids:
+            for index, item_id in enumerate(item_ids):
+                self.tree.move(item_id, '', index)
+
+        # Update scrollbar to reflect the position within the full result set
+        if self.total_records:
+            self.table_scrollbar.set(start / self.total_records, end / self.total_records)
+        else:
+            self.table_scrollbar.set(0, 1)
+
+    def display_values(self, record):
+        """Format a stored record for the table (dates as MM/DD/YY)"""
+        loan_id, student_name, title, borrow_date, return_date, fine, book_id = record
+        return (loan_id, student_name, title,
+                to_display_date(borrow_date), to_display_date(return_date), fine, book_id)
+
+    def stats_job(self, selection):
+        """Job reading the circulation figures, and the selected loan's if any"""
+        def read_stats(service):
+            if selection is None:
+                return service.circulation_stats(), None
+            student_name, book_id = selection
+            return service.circulation_stats(), (service.student_stats(student_name),
+                                                 service.book_stats(book_id))
+        return read_stats
+
+    def refresh_stats(self):
+        """Read the maintained circulation figures in the background"""
+        selection = self.stats_selection
+        self.db.submit(self.stats_job(selection),
+                       lambda result: self.show_stats(selection, *result),
+                       self.report_error("Error loading statistics"))
+
+    def poll_stats(self, delay=STATS_REFRESH_MS):
+        """Refresh the figures now and then every STATS_REFRESH_MS.
+
+        No one asked for these refreshes, so a failure shows no dialog: it is
+        logged and the next try waits twice as long, up to STATS_REFRESH_MAX_MS.
+        """
+        selection = self.stats_selection
+
+        def shown(result):
+            self.show_stats(selection, *result)
+            self.root.after(STATS_REFRESH_MS, self.poll_stats)
+
+        def failed(error):
+            print(f"Error loading statistics: {error}", file=sys.stderr)
+            retry = min(delay * 2, STATS_REFRESH_MAX_MS)
+            self.root.after(retry, lambda: self.poll_stats(retry))
+
+        self.db.submit(self.stats_job(selection), shown, failed)
+
+    def show_stats(self, selection, totals, selected):
+        """Show the circulation figures next to the records count"""
+        active_loans, overdue_loans, outstanding_fines = totals
+        text = f"Out: {active_loans} | Overdue: {overdue_loans} | Fines: R{outstanding_fines:.2f}"
+        if selected is not None and selection == self.stats_selection:
+            (open_loans, student_fines), book_loans = selected
+            text += (f"  |  {selection[0]}: {open_loans} out, R{student_fines:.2f}"
+                     f" | Book: {book_loans} out")
+        self.stats_label.config(text=text)
+
+    def update_records_label(self):
+        """Show the number of records matching the current search"""
+        if self.search.clause and self.total_records >= SEARCH_COUNT_LIMIT:
+            self.records_label.config(text=f"Records: {self.total_records}+")
+        else:
+            self.records_label.config(text=f"Records: {self.total_records}")
+
+    def table_records_added(self, records, search, matches):
+        """Add newly inserted records to the table with one refresh"""
+        # A search started since the insert already counts the new records
+        if search is not self.search:
+            return
+        records = [record for record, match in zip(records, matches) if match]
+        if not records:
+            return
+        if self.order != ID_ORDER:
+            # Only the id order is known to put new records at the end
+            self.refresh_table()
+            return
 
-        # Insert filtered data
+        # New ids are always the largest, so the records belong at the end. A page
+        # fetched after the insert committed may already hold some of them.
+        at_end = self.cache_offset + len(self.page_cache) == self.total_records
         for record in records:
-            item_id = self.tree.insert('', 'end', values=record)
-            if record[5] > 0:
-                self.tree.item(item_id, tags=('overdue',))
-
-        # Update records count
-        self.records_label.config(text=f"Records: {len(records)}")
-
-    def calculate_fine(self, return_date_str):
-        """Calculate fine based on return date (R5 per day)"""
-        try:
-            return_date = datetime.strptime(return_date_str, '%m/%d/%y')
-            today = datetime.now()
+            already_cached = self.page_cache and self.page_cache[-1][0] >= record[0]
+            if at_end and not already_cached:
+                self.page_cache.append(record)
+                self.cache_version += 1
+        self.total_records += len(records)
+        self.render_table()
+        self.update_records_label()
+
+    def table_records_removed(self, loan_ids):
+        """Remove deleted or returned records from the table with one refresh"""
+        loan_ids = set(loan_ids)
+        cached_ids = {record[0] for record in self.page_cache}
+        if not loan_ids <= cached_ids:
+            # Not all in the cached window, so their positions are unknown
+            self.refresh_table()
+            return
+
+        self.page_cache = [record for record in self.page_cache if record[0] not in loan_ids]
+        self.cache_version += 1
+        self.total_records -= len(loan_ids)
+        self.render_table()
+        self.update_records_label()
+
+    def on_table_scroll(self, action, value, unit=None):
+        """Handle scrollbar drags and clicks"""
+        if action == 'moveto':
+            self.view_offset = int(float(value) * self.total_records)
+        elif action == 'scroll':
+            step = self.visible_rows if unit == 'pages' else 1
+            self.view_offset += int(value) * step
+        self.render_table()
+
+    def on_table_wheel(self, event):
+        """Scroll the virtual table with the mouse wheel"""
+        if event.num == 4 or event.delta > 0:
+            self.view_offset -= 3
+        else:
+            self.view_offset += 3
+        self.render_table()
+        return 'break'
+
+    def on_table_resize(self, event):
+        """Recompute how many rows fit when the table is resized"""
+        visible_rows = max(1, (event.height - TABLE_HEADER_HEIGHT) // TABLE_ROW_HEIGHT)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.render_table()
+
+    def update_fines(self):
+        """Recompute the fines of all loans in the background"""
+        self.fines_btn.config(state=tk.DISABLED)
+        self.db.submit(lambda service: service.recompute_fines(), self.fines_updated,
+                       self.fines_failed)
+
+    def fines_updated(self, changed):
+        """Show refreshed fines once the recalculation has been committed"""
+        self.fines_btn.config(state=tk.NORMAL)
+        self.refresh_table()
+        self.refresh_stats()
+        messagebox.showinfo("Success", f"Fines updated ({changed} records changed)")
 
-            if return_date < today:
-                days_late = (today - return_date).days
-                return days_late * 5.0
-            else:
-                return 0.0
-        except ValueError:
-            return 0.0
+    def fines_failed(self, error):
+        """Report a failed fine recalculation"""
+        self.fines_btn.config(state=tk.NORMAL)
+        messagebox.showerror("Error", f"Error updating fines: {str(error)}")
 
     def validate_date(self, date_str):
         """Validate date format"""
@@ -358,7 +1074,7 @@ class LibraryManagementApp:
         try:
             # Validate inputs
             student_name = self.student_name.get().strip()
-            book_title = self.book_var.get()
+            book_title = self.book_var.get().strip()
 
             if not student_name:
                 messagebox.showerror("Error", "Please enter student name")
@@ -369,7 +1085,7 @@ class LibraryManagementApp:
                 return
 
             # Get book ID
-            book_id = self.books_dict.get(book_title)
+            book_id = self.find_book_id(book_title)
             if not book_id:
                 messagebox.showerror("Error", "Invalid book selection")
                 return
@@ -387,106 +1103,198 @@ class LibraryManagementApp:
                 messagebox.showerror("Error", "Invalid return date format. Use MM/DD/YY")
                 return
 
-            # Validate dates
-            borrow_dt = datetime.strptime(borrow_date, '%m/%d/%y')
-            return_dt = datetime.strptime(return_date, '%m/%d/%y')
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            # Dates must not be in the past; the service checks that when it commits
+            borrow_dt = datetime.strptime(borrow_date, '%m/%d/%y').date()
+            return_dt = datetime.strptime(return_date, '%m/%d/%y').date()
 
-            if borrow_dt < today:
-                messagebox.showerror("Error", "Borrow date cannot be in the past")
-                return
+            search = self.search
+            self.db.submit(lambda service: self.borrow_job(service, search, student_name,
+                                                            book_id, borrow_dt, return_dt),
+                           lambda result: self.record_borrowed(result[0], search, *result[1:]),
+                           self.borrow_failed)
 
-            if return_dt < borrow_dt:
-                messagebox.showerror("Error", "Return date cannot be before borrow date")
-                return
+        except Exception as e:
+            messagebox.showerror("Error", f"Error adding record: {str(e)}")
 
-            # Calculate fine
-            fine = self.calculate_fine(return_date)
+    def borrow_job(self, service, search, student_name, book_id, borrow_date, return_date):
+        """Worker job: commit a borrow and check it against the search it was made under"""
+        record = service.borrow(student_name, book_id, borrow_date, return_date)
+        return record, service.loan_matches_search(search, record[0]), service.get_books([book_id])
 
-            # Insert record
-            self.cursor.execute('''
-                INSERT INTO borrowed_books (student_name, book_id, borrow_date, return_date, fine)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (student_name, book_id, borrow_date, return_date, fine))
+    def record_borrowed(self, record, search, matches, books):
+        """Update the UI once a borrow record has been committed"""
+        # Refresh UI (only the new row and the borrowed book's stock change)
+        self.update_book_availability(books)
+        self.table_records_added([record], search, [matches])
+        self.refresh_stats()
+        self.clear_form()
 
-            # Update book quantity
-            self.cursor.execute('''
-                UPDATE books SET quantity = quantity - 1 WHERE id = ?
-            ''', (book_id,))
+        messagebox.showinfo("Success", "Book borrowed successfully!")
 
-            self.conn.commit()
+    def borrow_failed(self, error):
+        """Report a failed borrow; the book list may be stale if another desk took the copy"""
+        self.report_error("Error adding record")(error)
+        self.refresh_books_combobox()
 
-            # Refresh UI
-            self.refresh_books_combobox()
-            self.refresh_table()
-            self.clear_form()
+    def selected_loan_ids(self):
+        """Loan ids of the selected rows (their Treeview item ids)"""
+        return [int(item_id) for item_id in self.tree.selection()]
+
+    def return_record(self):
+        """Check the selected loans back in"""
+        try:
+            loan_ids = self.selected_loan_ids()
+            if not loan_ids:
+                messagebox.showwarning("Warning", "Please select a record to return")
+                return
 
-            messagebox.showinfo("Success", "Book borrowed successfully!")
+            self.db.submit(lambda service: self.return_job(service, loan_ids),
+                           lambda result: self.records_returned(loan_ids, *result),
+                           self.report_error("Error returning record"))
 
         except Exception as e:
-            messagebox.showerror("Error", f"Error adding record: {str(e)}")
+            messagebox.showerror("Error", f"Error returning record: {str(e)}")
+
+    def return_job(self, service, loan_ids):
+        """Worker job: close loans in one transaction and fetch their books' new stock"""
+        returned = service.return_loans(loan_ids)
+        return returned, service.get_books({book_id for _, book_id, _ in returned})
+
+    def records_returned(self, loan_ids, returned, books):
+        """Update the UI once returns have been committed"""
+        # Returned loans leave the table; the history keeps them
+        self.update_book_availability(books)
+        self.table_records_removed(loan_ids)
+        self.clear_form()
+        self.refresh_stats()
+
+        fine = sum(fine for _, _, fine in returned)
+        message = ("Book returned" if len(returned) == 1
+                   else f"{len(returned)} books returned")
+        if fine > 0:
+            messagebox.showinfo("Success", f"{message}. Fine due: R{fine:.2f}")
+        else:
+            messagebox.showinfo("Success", f"{message} successfully!")
+
+    def compact_loans(self):
+        """Move one batch of returned loans to the history, then schedule the next run"""
+        def compacted(moved):
+            # Keep going while there is a backlog; other jobs run between batches
+            delay = 1 if moved == COMPACT_BATCH_SIZE else COMPACT_INTERVAL_MS
+            self.root.after(delay, self.compact_loans)
+
+        def failed(error):
+            # Another desk may hold the lock; try again at the next interval
+            print(f"Error archiving returned loans: {error}", file=sys.stderr)
+            self.root.after(COMPACT_INTERVAL_MS, self.compact_loans)
+
+        self.db.submit(lambda service: service.compact_loans(), compacted, failed)
 
     def delete_record(self):
-        """Delete selected record"""
+        """Delete the selected records"""
         try:
-            selected = self.tree.selection()
-            if not selected:
+            loan_ids = self.selected_loan_ids()
+            if not loan_ids:
                 messagebox.showwarning("Warning", "Please select a record to delete")
                 return
 
             # Confirm deletion
-            if not messagebox.askyesno("Confirm", "Are you sure you want to delete this record?"):
+            if len(loan_ids) == 1:
+                question = "Are you sure you want to delete this record?"
+            else:
+                question = f"Are you sure you want to delete these {len(loan_ids)} records?"
+            if not messagebox.askyesno("Confirm", question):
                 return
 
-            # Get record details
-            item = self.tree.item(selected[0])
-            record_id = item['values'][0]
-            book_title = item['values'][2]
-
-            # Get book ID
-            self.cursor.execute("SELECT id FROM books WHERE title = ?", (book_title,))
-            book_result = self.cursor.fetchone()
-
-            if book_result:
-                book_id = book_result[0]
-
-                # Delete record
-                self.cursor.execute("DELETE FROM borrowed_books WHERE id = ?", (record_id,))
-
-                # Update book quantity
-                self.cursor.execute('''
-                    UPDATE books SET quantity = quantity + 1 WHERE id = ?
-                ''', (book_id,))
-
-                self.conn.commit()
-
-                # Refresh UI
-                self.refresh_books_combobox()
-                self.refresh_table()
-
-                messagebox.showinfo("Success", "Record deleted successfully!")
-            else:
-                messagebox.showerror("Error", "Book not found")
+            self.db.submit(lambda service: service.get_books(service.delete_loans(loan_ids)),
+                           lambda books: self.records_deleted(loan_ids, books),
+                           self.report_error("Error deleting record"))
 
         except Exception as e:
             messagebox.showerror("Error", f"Error deleting record: {str(e)}")
 
+    def records_deleted(self, loan_ids, books):
+        """Update the UI once a delete has been committed"""
+        # Refresh UI (only the deleted rows and their books' stock change)
+        self.update_book_availability(books)
+        self.table_records_removed(loan_ids)
+        self.refresh_stats()
+
+        if len(loan_ids) == 1:
+            messagebox.showinfo("Success", "Record deleted successfully!")
+        else:
+            messagebox.showinfo("Success", f"{len(loan_ids)} records deleted successfully!")
+
+    def open_batch_checkout(self):
+        """Open a batch checkout window for scanning a student's books"""
+        BatchCheckout(self)
+
+    def open_diagnostics(self):
+        """Show the profiling histograms in a window that refreshes itself"""
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("890x400")
+
+        columns = ('Kind', 'Name', 'Count', 'Failed', 'Mean', 'p50', 'p90', 'p99', 'Max',
+                   'Rows')
+        tree = ttk.Treeview(window, columns=columns, show='headings')
+        for column in columns:
+            tree.heading(column, text=column if column in ('Kind', 'Name', 'Count', 'Failed',
+                                                           'Rows')
+                         else f'{column} ms')
+            tree.column(column, width=70, anchor=tk.CENTER)
+        tree.column('Kind', width=90, anchor=tk.W)
+        tree.column('Name', width=170, anchor=tk.W)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 0))
+
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="Reset",
+                   command=self.instrumentation.reset).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Save JSON Lines...",
+                   command=self.save_diagnostics).pack(side=tk.LEFT, padx=(10, 0))
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for row in self.instrumentation.snapshot():
+                rows = '' if row['mean_rows'] is None else f"{row['mean_rows']:.0f}"
+                tree.insert('', tk.END, values=(
+                    row['kind'], row['name'], row['count'], row['failures'],
+                    f"{row['mean_ms']:.2f}",
+                    f"{row['p50_ms']:.2f}", f"{row['p90_ms']:.2f}", f"{row['p99_ms']:.2f}",
+                    f"{row['max_ms']:.2f}", rows))
+            window.after(DIAGNOSTICS_REFRESH_MS, refresh)
+
+        refresh()
+
+    def save_diagnostics(self):
+        """Write the current profiling summaries to a JSON lines file"""
+        path = filedialog.asksaveasfilename(defaultextension='.jsonl',
+                                            filetypes=[("JSON Lines", "*.jsonl")])
+        if not path:
+            return
+        try:
+            self.instrumentation.dump(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Error saving diagnostics: {str(e)}")
+
     def clear_form(self):
         """Clear the form and reset to defaults"""
         self.student_name.set("")
         self.book_var.set("")
+        self.selected_book = None
+        if self.stats_selection is not None:
+            self.stats_selection = None
+            self.refresh_stats()
+        if self.book_prefix:
+            self.refresh_books_combobox()
 
         # Reset dates to today
-        today_str = datetime.now().strftime('%m/%d/%y')
-        if TK_CALENDAR_AVAILABLE:
-            today = datetime.now()
-            self.borrow_date.set_date(today)
-            self.return_date.set_date(today)
-        else:
-            self.borrow_date.delete(0, tk.END)
-            self.borrow_date.insert(0, today_str)
-            self.return_date.delete(0, tk.END)
-            self.return_date.insert(0, today_str)
+        today = datetime.now().strftime(DATE_FORMAT)
+        self.set_date_in_widget(self.borrow_date, today)
+        self.set_date_in_widget(self.return_date, today)
 
         # Clear tree selection
         for item in self.tree.selection():
@@ -495,38 +1303,223 @@ class LibraryManagementApp:
     def on_tree_select(self, event):
         """Handle treeview selection"""
         selected = self.tree.selection()
+        self.selected_book = None
         if selected:
-            item = self.tree.item(selected[0])
-            values = item['values']
+            shown = self.row_items.get(int(selected[0]))
+            if shown is None:
+                return
+            _, student_name, title, borrow_date, return_date, _, book_id = shown[1]
 
             # Populate form with selected record
-            self.student_name.set(values[1])
-            self.book_var.set(values[2])
+            self.student_name.set(student_name)
+            self.book_var.set(title)
+            self.selected_book = (book_id, title)
+            self.refresh_books_combobox()
+            self.stats_selection = (student_name, book_id)
+            self.refresh_stats()
 
             # Set dates
             try:
-                if TK_CALENDAR_AVAILABLE:
-                    borrow_dt = datetime.strptime(values[3], '%m/%d/%y')
-                    return_dt = datetime.strptime(values[4], '%m/%d/%y')
-                    self.borrow_date.set_date(borrow_dt)
-                    self.return_date.set_date(return_dt)
-                else:
-                    self.borrow_date.delete(0, tk.END)
-                    self.borrow_date.insert(0, values[3])
-                    self.return_date.delete(0, tk.END)
-                    self.return_date.insert(0, values[4])
+                self.set_date_in_widget(self.borrow_date, borrow_date)
+                self.set_date_in_widget(self.return_date, return_date)
             except ValueError:
                 pass
 
 
+def seed_command(args):
+    """Insert the sample books and loans into the database"""
+    conn = connect_database(args.db)
+    seed_database(conn)
+    conn.close()
+    print(f"Sample data added to {args.db}")
+
+
+def recompute_fines_command(args):
+    """Recompute the fines of all loans for today"""
+    service = LibraryService.open(args.db, args.fine_rate)
+    changed = service.recompute_fines()
+    service.close()
+    print(f"Fines updated at R{args.fine_rate:g} per day ({changed} records changed)")
+
+
+def check_stats_command(args):
+    """Rebuild the circulation statistics from the loans and report differences"""
+    conn = connect_database(args.db)
+    try:
+        differences = check_stats(conn)
+        for difference in differences:
+            print(difference)
+        if differences and args.repair:
+            rebuild_stats(conn)
+            print(f"Statistics rebuilt ({len(differences)} differences fixed)")
+        elif differences:
+            sys.exit(f"{len(differences)} differences found (use --repair to rebuild)")
+        else:
+            print("Statistics are consistent")
+    finally:
+        conn.close()
+
+
+def compact_command(args):
+    """Move all returned loans to the loan history"""
+    service = LibraryService.open(args.db, args.fine_rate)
+    moved = 0
+    while True:
+        batch = service.compact_loans()
+        if not batch:
+            break
+        moved += batch
+    service.close()
+    print(f"Moved {moved} returned loans to the history")
+
+
+def report_command(args):
+    """Print overdue, fine and title figures for the open loans"""
+    # The snapshot loads NumPy, which the window never needs, so import it here
+    from library_snapshot import LoanSnapshot
+
+    conn = connect_database(args.db)
+    try:
+        snapshot = LoanSnapshot(conn)
+        snapshot.load()
+    finally:
+        conn.close()
+    filters = {'student': args.student, 'title': args.title}
+    print(f"{snapshot.count(**filters)} loans out, {snapshot.overdue_ratio(**filters):.1%} "
+          f"overdue, R{snapshot.total_fines(**filters):.2f} in fines")
+    print(f"\nDue dates in {args.bucket_days}-day periods:")
+    print(f"  {'from':<10}{'loans':>8}{'fines':>12}")
+    for first_day, loans, fines in snapshot.fines_by_due_date(args.bucket_days, **filters):
+        shown = first_day.strftime(DISPLAY_DATE_FORMAT) if first_day else 'unknown'
+        print(f"  {shown:<10}{loans:>8}{fines:>12.2f}")
+    print("\nMost borrowed titles:")
+    for title, loans in snapshot.loans_per_title(args.top, **filters):
+        print(f"  {loans:>6}  {title}")
+
+
+def notices_command(args):
+    """Write reminder notices for loans due soon and overdue loans"""
+    kinds = NOTICE_KINDS if args.kind == 'all' else (args.kind,)
+    spool = MboxSpool(args.mbox) if args.mbox else DirectorySpool(args.dir)
+    conn = connect_database(args.db)
+    try:
+        counts = write_notices(conn, spool, days=args.days, kinds=kinds,
+                               checkpoint_path=args.checkpoint, rate=args.fine_rate,
+                               sender=args.sender, domain=args.domain)
+    except ValueError as e:
+        sys.exit(f"Notices not written: {str(e)}")
+    finally:
+        spool.close()
+        conn.close()
+    print(f"Wrote {counts['overdue']} overdue and {counts['due-soon']} due-soon notices "
+          f"to {args.mbox or args.dir}")
+
+
+def import_command(args):
+    """Import books or loans from a CSV file"""
+    def report_reject(line, reason):
+        print(f"{args.file}:{line}: skipped ({reason})", file=sys.stderr)
+
+    conn = connect_database(args.db)
+    try:
+        with open(args.file, newline='', encoding='utf-8') as csv_file:
+            imported = import_csv(conn, args.table, csv_file, report_reject)
+    except (sqlite3.Error, ValueError) as e:
+        # Batches committed before the failure stay imported
+        sys.exit(f"Import failed: {str(e)}")
+    finally:
+        conn.close()
+    print(f"Imported {imported} {args.table} from {args.file}")
+
+
+def export_command(args):
+    """Export books, open loans, loan history or the circulation journal to a CSV file"""
+    conn = connect_database(args.db)
+    try:
+        with open(args.file, 'w', newline='', encoding='utf-8') as csv_file:
+            exported = export_csv(conn, args.table, csv_file)
+    finally:
+        conn.close()
+    print(f"Exported {exported} {args.table} to {args.file}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument('--db', default=DATABASE_PATH, help="SQLite database file")
+    parser.add_argument('--fine-rate', type=float, default=FINE_PER_DAY,
+                        help="fine per overdue day (default: %(default)s)")
+    parser.add_argument('--desk', default=DEFAULT_DESK,
+                        help="desk name recorded in the circulation journal "
+                             "(default: this computer's name)")
+    parser.add_argument('--profile', action='store_true',
+                        help="time queries and UI handlers and show a diagnostics window")
+    parser.add_argument('--profile-log', metavar='FILE',
+                        help="also append every measurement to a JSON lines file "
+                             "(implies --profile)")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('seed', help="insert sample books and loans").set_defaults(
+        handler=seed_command)
+    commands.add_parser('recompute-fines', help="recompute the fines of all loans").set_defaults(
+        handler=recompute_fines_command)
+    commands.add_parser('compact', help="move returned loans to the history").set_defaults(
+        handler=compact_command)
+    check_parser = commands.add_parser(
+        'check-stats', help="compare the circulation statistics with the loans")
+    check_parser.add_argument('--repair', action='store_true',
+                              help="rebuild the statistics if they differ")
+    check_parser.set_defaults(handler=check_stats_command)
+    report_parser = commands.add_parser(
+        'report', help="summarize the open loans by due date and title")
+    report_parser.add_argument('--bucket-days', type=int, default=7,
+                               help="days per due-date period (default: %(default)s)")
+    report_parser.add_argument('--top', type=int, default=10,
+                               help="number of titles listed (default: %(default)s)")
+    report_parser.add_argument('--student', help="only the loans of this student")
+    report_parser.add_argument('--title', help="only the loans of this book title")
+    report_parser.set_defaults(handler=report_command)
+    notices_parser = commands.add_parser(
+        'notices', help="write reminders for loans due soon and overdue loans")
+    spool_options = notices_parser.add_mutually_exclusive_group(required=True)
+    spool_options.add_argument('--dir', help="write one text file per notice to this directory")
+    spool_options.add_argument('--mbox', help="append the notices to this mbox spool file")
+    notices_parser.add_argument('--days', type=int, default=DUE_SOON_DAYS,
+                                help="remind loans due within this many days "
+                                     "(default: %(default)s)")
+    notices_parser.add_argument('--kind', choices=NOTICE_KINDS + ('all',), default='all',
+                                help="which notices to write (default: %(default)s)")
+    notices_parser.add_argument('--checkpoint', metavar='FILE',
+                                help="save progress here and resume from it if present")
+    notices_parser.add_argument('--sender', default=NOTICE_SENDER,
+                                help="From address of the notices (default: %(default)s)")
+    notices_parser.add_argument('--domain', default=NOTICE_DOMAIN,
+                                help="mail domain of the student addresses "
+                                     "(default: %(default)s)")
+    notices_parser.set_defaults(handler=notices_command)
+    for name, handler, tables, help_text in (
+            ('import', import_command, CSV_IMPORT_TABLES, "import a CSV file"),
+            ('export', export_command, sorted(CSV_COLUMNS), "export to a CSV file")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('table', choices=tables)
+        command.add_argument('file', help="CSV file path")
+        command.set_defaults(handler=handler)
+    args = parser.parse_args()
+
+    # Headless commands run without opening a window
+    if args.command:
+        args.handler(args)
+        return
+
     root = tk.Tk()
-    app = LibraryManagementApp(root)
+    instrumentation = None
+    if args.profile or args.profile_log:
+        instrumentation = Instrumentation(args.profile_log)
+    app = LibraryManagementApp(root, args.db, args.fine_rate, instrumentation, args.desk)
 
     # Handle window close
     def on_closing():
-        if hasattr(app, 'conn'):
-            app.conn.close()
+        app.db.close()
+        if instrumentation:
+            instrumentation.close()
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -0,0 +1,602 @@
+"""Synthetic-load benchmarks for the library service layer.
+
+Builds libraries of increasing size and reports latency percentiles for the
+operations behind the main window:
+
+    refresh_table           count the loans and fetch the page at a random offset
+    scroll_table            fetch the next page with keyset pagination
+    search_records          count and fetch the first page for a search
+    sort_table              fetch the first page in a column order (with or without a search)
+    scroll_sorted           fetch the next page in that order with keyset pagination
+    refresh_books_combobox  list the available books matching a typed title prefix
+    add_borrow_record       borrow a book
+    return_record           check a loan back in
+    delete_record           delete a loan and restock its book
+    bulk_return             check in a selection of loans in one transaction
+    batch_checkout          lend a scanned basket of books in one transaction
+    snapshot_load           read the open loans into a columnar snapshot (once per scale)
+    report_snapshot         refresh the snapshot and compute the report figures from it
+    snapshot_refresh        bring the snapshot up to date after one checkout
+
+The stress command runs many checkout desks as separate processes against
+one database file and then checks that no copy was lent out twice.
+
+The throughput command runs many checkout counters as threads of one
+process, first each committing its own transactions and then all sharing a
+GroupCommitter, and compares the sustained operations per second.
+
+The startup command launches the application in fresh processes against a
+generated library (it needs a display) and reports how long the window
+takes to appear and for the table and book list to fill:
+
+    first_paint             the window is mapped and drawn
+    table                   the first page of loans is shown
+    book_picker             the book list holds the available books
+
+Usage:
+    python library_benchmark.py --scales 10000 100000 1000000
+    python library_benchmark.py --save baseline.json
+    python library_benchmark.py --compare baseline.json
+    python library_benchmark.py stress --clients 16 --operations 500
+    python library_benchmark.py throughput --counters 16 --synchronous FULL
+    python library_benchmark.py startup --scales 1000000 --runs 10
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+from library_service import (DATE_FORMAT, LOAN_ORDERS, NO_SEARCH, LibraryError,
+                             LibraryService, LoanOrder, build_search, connect_database,
+                             insert_book_batch, insert_loan_batch, order_position)
+from library_group_commit import GROUP_COMMIT_SIZE, GROUP_COMMIT_WINDOW, GroupCommitter
+from library_snapshot import LoanSnapshot
+
+DEFAULT_SCALES = (10000, 100000, 1000000)
+DEFAULT_REPEAT = 200
+DEFAULT_TOLERANCE = 0.25
+REGRESSION_FLOOR_MS = 1.0  # ignore growth smaller than timer noise
+PAGE_SIZE = 75  # visible rows plus the buffer on both sides
+BULK_SELECTION = 10  # rows selected for one bulk return
+BASKET_SIZE = 10  # books scanned into one batch checkout
+GENERATE_BATCH_SIZE = 10000
+
+# Startup test settings: the application is started this many times per scale,
+# and the window should appear within the target
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'Tkinter-based-library management-application.py')
+STARTUP_RUNS = 10
+STARTUP_TARGET_MS = 300
+STARTUP_TIMEOUT = 60  # seconds to wait for the table and book list
+STARTUP_MILESTONES = ('first_paint', 'table', 'book_picker')
+
+# Stress test settings: every desk keeps returning some of its loans, and a
+# share of the checkouts all go for the same few copies of one popular book
+STRESS_COPIES = 3
+STRESS_RETURN_FRACTION = 0.3
+HOT_BOOK_ID = 1
+
+# Throughput test settings: enough copies that checkouts do not run out
+THROUGHPUT_COPIES = 1000
+
+FIRST_NAMES = ('John', 'Emma', 'Michael', 'Thandi', 'Sipho', 'Aisha', 'Lerato', 'David',
+               'Naledi', 'Pieter', 'Zanele', 'Ravi', 'Sarah', 'Kagiso', 'Ayanda', 'Chen')
+LAST_NAMES = ('Smith', 'Wilson', 'Brown', 'Nkosi', 'Dlamini', 'Patel', 'Botha', 'Mokoena',
+              'Naidoo', 'van der Merwe', 'Khumalo', 'Jacobs', 'Pillay', 'Zulu', 'Adams')
+TITLE_WORDS = ('Introduction', 'Python', 'Data', 'Structures', 'Algorithms', 'Machine',
+               'Learning', 'Database', 'Systems', 'Web', 'Development', 'Networks',
+               'History', 'Economics', 'Physics', 'Chemistry', 'Biology', 'Statistics')
+SEARCH_TERMS = ('smith', 'emma', 'data', 'python', 'naidoo', 'physics', 'th', 'zz')
+BOOK_PREFIXES = ('', 'd', 'Da', 'data s', 'PHYSICS', 'Web Dev', 'q')
+
+
+def percentile(samples, fraction):
+    """Return the sample at a fraction (0-1) of the sorted samples"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    """Summarize latencies (seconds) as milliseconds"""
+    return {
+        'p50': percentile(samples, 0.50) * 1000,
+        'p90': percentile(samples, 0.90) * 1000,
+        'p99': percentile(samples, 0.99) * 1000,
+        'max': max(samples) * 1000,
+    }
+
+
+def generate_library(path, loans, rng):
+    """Create a database with a synthetic catalog and loan history"""
+    conn = connect_database(path)
+    book_count = max(100, loans // 10)
+
+    for start in range(0, book_count, GENERATE_BATCH_SIZE):
+        rows = [(line, None, ' '.join(rng.sample(TITLE_WORDS, 3)) + f' Vol. {line}',
+                 rng.randint(0, 5))
+                for line in range(start + 1, min(book_count, start + GENERATE_BATCH_SIZE) + 1)]
+        insert_book_batch(conn, rows)
+
+    first_day = date.today() - timedelta(days=730)
+    for start in range(0, loans, GENERATE_BATCH_SIZE):
+        rows = []
+        for line in range(start + 1, min(loans, start + GENERATE_BATCH_SIZE) + 1):
+            borrowed = first_day + timedelta(days=rng.randint(0, 730))
+            returned = borrowed + timedelta(days=rng.randint(7, 28))
+            rows.append((line, None, f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                         rng.randint(1, book_count), borrowed.strftime(DATE_FORMAT),
+                         returned.strftime(DATE_FORMAT), 0.0))
+        insert_loan_batch(conn, rows, on_reject=lambda line, reason: None)
+
+    conn.close()
+
+
+def timed(samples, operation, *args):
+    """Run an operation once, record its latency and return its result"""
+    started = time.perf_counter()
+    result = operation(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def run_scale(path, repeat, rng):
+    """Benchmark every operation against one database"""
+    service = LibraryService.open(path)
+    samples = {name: [] for name in ('refresh_table', 'scroll_table', 'search_records',
+                                     'sort_table', 'scroll_sorted',
+                                     'refresh_books_combobox', 'add_borrow_record',
+                                     'return_record', 'delete_record', 'bulk_return',
+                                     'batch_checkout', 'snapshot_load', 'report_snapshot',
+                                     'snapshot_refresh')}
+    snapshot = LoanSnapshot(service.conn)
+
+    def refresh_table():
+        total = service.count_loans(NO_SEARCH)
+        return service.fetch_loans_from(NO_SEARCH, rng.randrange(max(1, total)), PAGE_SIZE)
+
+    def search_records(text):
+        search = build_search(text)
+        service.count_loans(search)
+        return service.fetch_loans_from(search, 0, PAGE_SIZE)
+
+    def report_snapshot():
+        snapshot.refresh()
+        return (snapshot.overdue_ratio(), snapshot.fines_by_due_date(),
+                snapshot.loans_per_title(10))
+
+    timed(samples['snapshot_load'], snapshot.load)
+    for _ in range(repeat):
+        page = timed(samples['refresh_table'], refresh_table)
+        if page:
+            timed(samples['scroll_table'], service.fetch_loans, NO_SEARCH, '>', (page[-1][0],),
+                  PAGE_SIZE)
+        timed(samples['search_records'], search_records, rng.choice(SEARCH_TERMS))
+
+        order = LoanOrder(rng.choice(sorted(LOAN_ORDERS)), rng.random() < 0.5)
+        search = build_search(rng.choice(('',) + SEARCH_TERMS))
+        page = timed(samples['sort_table'], service.fetch_loans_from, search, 0, PAGE_SIZE,
+                     order)
+        if page:
+            timed(samples['scroll_sorted'], service.fetch_loans, search, '>',
+                  order_position(order, page[-1]), PAGE_SIZE, False, order)
+        timed(samples['report_snapshot'], report_snapshot)
+
+    # Borrow copies that are in stock, then return or delete them and archive the
+    # returns so reruns see the same open loans
+    books = service.search_books('', repeat * 2)
+    rng.shuffle(books)
+    borrowed = []
+    for book_id, _, _ in books[:repeat]:
+        timed(samples['refresh_books_combobox'], service.search_books, rng.choice(BOOK_PREFIXES))
+        record = timed(samples['add_borrow_record'], service.borrow, 'Benchmark Student',
+                       book_id, date.today(), date.today() + timedelta(days=14))
+        borrowed.append(record[0])
+        timed(samples['snapshot_refresh'], snapshot.refresh)
+    baskets = books[repeat:]
+    for start in range(0, len(baskets), BASKET_SIZE):
+        records = timed(samples['batch_checkout'], service.borrow_many, 'Benchmark Student',
+                        [book_id for book_id, _, _ in baskets[start:start + BASKET_SIZE]],
+                        date.today(), date.today() + timedelta(days=14))
+        borrowed.extend(record[0] for record in records)
+    singles, selections = borrowed[:repeat // 2], borrowed[repeat // 2:]
+    for number, loan_id in enumerate(singles):
+        if number % 2:
+            timed(samples['delete_record'], service.delete_loans, [loan_id])
+        else:
+            timed(samples['return_record'], service.return_loans, [loan_id])
+    for start in range(0, len(selections), BULK_SELECTION):
+        timed(samples['bulk_return'], service.return_loans,
+              selections[start:start + BULK_SELECTION])
+    while service.compact_loans():
+        pass
+
+    service.close()
+    return {name: summarize(values) for name, values in samples.items() if values}
+
+
+def print_results(scale, results):
+    """Print one scale's percentiles as a table"""
+    print(f"\n{scale:,} loans")
+    print(f"  {'operation':<24}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in results.items():
+        print(f"  {name:<24}{stats['p50']:>10.2f}{stats['p90']:>10.2f}"
+              f"{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+
+
+def find_regressions(results, baseline, tolerance):
+    """List operations whose p90 grew by more than tolerance over the baseline"""
+    regressions = []
+    for scale, operations in results.items():
+        for name, stats in operations.items():
+            before = baseline.get(scale, {}).get(name)
+            if not before:
+                continue
+            allowed = max(before['p90'] * (1 + tolerance), before['p90'] + REGRESSION_FLOOR_MS)
+            if stats['p90'] > allowed:
+                regressions.append(f"{scale} loans, {name}: p90 {before['p90']:.2f} ms -> "
+                                   f"{stats['p90']:.2f} ms")
+    return regressions
+
+
+def desk_worker(path, desk, operations, book_count, hot_fraction, seed):
+    """Run one checkout desk in its own process and return what it did"""
+    service = LibraryService.open(path)
+    rng = random.Random(seed + desk)
+    today = date.today()
+    loans = []
+    stats = {'borrowed': 0, 'returned': 0, 'unavailable': 0, 'failed': 0, 'latencies': []}
+
+    for _ in range(operations):
+        try:
+            if loans and rng.random() < STRESS_RETURN_FRACTION:
+                loan_id = loans.pop(rng.randrange(len(loans)))
+                timed(stats['latencies'], service.return_loans, [loan_id])
+                stats['returned'] += 1
+            else:
+                book_id = HOT_BOOK_ID if rng.random() < hot_fraction else rng.randint(1, book_count)
+                record = timed(stats['latencies'], service.borrow, f'Desk {desk}', book_id,
+                               today, today + timedelta(days=14))
+                loans.append(record[0])
+                stats['borrowed'] += 1
+        except LibraryError:
+            stats['unavailable'] += 1
+        except sqlite3.OperationalError:
+            # Still locked after every retry
+            stats['failed'] += 1
+
+    stats['busy_retries'] = service.busy_retries
+    service.close()
+    return stats
+
+
+def check_stock(path, copies):
+    """List the books whose stock does not add up with their open loans"""
+    conn = sqlite3.connect(path)
+    problems = [f"book {book_id}: quantity {quantity}, {loans} open loans"
+                for book_id, quantity, loans in conn.execute('''
+                    SELECT b.id, b.quantity,
+                           (SELECT COUNT(*) FROM borrowed_books bb
+                            WHERE bb.book_id = b.id AND bb.returned_date IS NULL)
+                    FROM books b
+                ''')
+                if quantity < 0 or quantity + loans != copies]
+    conn.close()
+    return problems
+
+
+def check_journal(path, copies):
+    """List the books whose stock is not their copies plus the journal's stock changes"""
+    conn = sqlite3.connect(path)
+    problems = [f"book {book_id}: quantity {quantity}, journal says {copies + change}"
+                for book_id, quantity, change in conn.execute('''
+                    SELECT b.id, b.quantity,
+                           (SELECT IFNULL(SUM(stock_change), 0) FROM circulation_journal j
+                            WHERE j.book_id = b.id)
+                    FROM books b
+                ''')
+                if quantity != copies + change]
+    conn.close()
+    return problems
+
+
+def stress_command(args):
+    """Run concurrent desks against one database and verify the stock afterwards"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'stress.db')
+        conn = connect_database(path)
+        insert_book_batch(conn, [(line, None, f'Stress Book {line}', STRESS_COPIES)
+                                 for line in range(1, args.books + 1)])
+        conn.close()
+
+        print(f"{args.clients} desks x {args.operations} operations on {args.books} books "
+              f"({args.hot:.0%} of checkouts for one book with {STRESS_COPIES} copies)")
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            futures = [pool.submit(desk_worker, path, desk, args.operations, args.books,
+                                   args.hot, args.seed)
+                       for desk in range(args.clients)]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(result[key] for result in results)
+                  for key in ('borrowed', 'returned', 'unavailable', 'failed', 'busy_retries')}
+        latencies = [latency for result in results for latency in result['latencies']]
+        operations = totals['borrowed'] + totals['returned']
+        print(f"  {operations / elapsed:,.0f} committed operations/s over {elapsed:.2f} s")
+        print("  " + ", ".join(f"{key.replace('_', ' ')} {value}"
+                               for key, value in totals.items()))
+        if latencies:
+            stats = summarize(latencies)
+            print(f"  latency p50 {stats['p50']:.2f} ms, p90 {stats['p90']:.2f} ms, "
+                  f"p99 {stats['p99']:.2f} ms, max {stats['max']:.2f} ms")
+
+        problems = check_stock(path, STRESS_COPIES) + check_journal(path, STRESS_COPIES)
+    if problems:
+        print("Stock is inconsistent:")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("  Stock is consistent")
+
+
+def counter_worker(execute, counter, operations, book_count, seed):
+    """Run one checkout counter's borrows and returns through execute(request)"""
+    rng = random.Random(seed + counter)
+    today = date.today()
+    loans = []
+    stats = {'committed': 0, 'unavailable': 0, 'failed': 0, 'latencies': []}
+
+    for _ in range(operations):
+        try:
+            if loans and rng.random() < STRESS_RETURN_FRACTION:
+                loan_ids = [loans.pop(rng.randrange(len(loans)))]
+                timed(stats['latencies'], execute,
+                      lambda service: service.return_loans(loan_ids))
+            else:
+                book_id = rng.randint(1, book_count)
+                record = timed(stats['latencies'], execute,
+                               lambda service: service.borrow(f'Counter {counter}', book_id,
+                                                              today, today + timedelta(days=14)))
+                loans.append(record[0])
+            stats['committed'] += 1
+        except LibraryError:
+            stats['unavailable'] += 1
+        except sqlite3.OperationalError:
+            # Still locked after every retry
+            stats['failed'] += 1
+    return stats
+
+
+def run_counters(path, args, grouped):
+    """Run the counters as threads, committing alone or through one GroupCommitter"""
+    committer = None
+    if grouped:
+        committer = GroupCommitter(lambda: LibraryService.open(path, desk='Group commit'),
+                                   args.group_size, args.window / 1000,
+                                   args.synchronous == 'FULL')
+
+    def counter(number):
+        if committer:
+            return counter_worker(lambda request: committer.submit(request).result(),
+                                  number, args.operations, args.books, args.seed)
+        service = LibraryService.open(path, desk=f'Counter {number}')
+        service.conn.execute(f"PRAGMA synchronous = {args.synchronous}")
+        try:
+            return counter_worker(lambda request: request(service),
+                                  number, args.operations, args.books, args.seed)
+        finally:
+            service.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.counters) as pool:
+        results = list(pool.map(counter, range(args.counters)))
+    elapsed = time.perf_counter() - started
+    if committer:
+        committer.close()
+
+    totals = {key: sum(result[key] for result in results)
+              for key in ('committed', 'unavailable', 'failed')}
+    stats = summarize([latency for result in results for latency in result['latencies']])
+    print(f"  {'group commit' if grouped else 'one commit per operation':<26}"
+          f"{totals['committed'] / elapsed:>10,.0f} operations/s  p50 {stats['p50']:.2f} ms, "
+          f"p90 {stats['p90']:.2f} ms, {totals['unavailable']} unavailable, "
+          f"{totals['failed']} failed"
+          + (f", {committer.committed / max(1, committer.groups):.1f} per group"
+             if committer else ""))
+    committed = totals['committed']
+    return committed / elapsed
+
+
+def throughput_command(args):
+    """Compare checkout throughput with and without group commit"""
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as temp_dir:
+        print(f"{args.counters} counters x {args.operations} operations on {args.books} books, "
+              f"synchronous = {args.synchronous}")
+        rates = []
+        for grouped in (False, True):
+            path = os.path.join(temp_dir, f'throughput_{grouped}.db')
+            conn = connect_database(path)
+            insert_book_batch(conn, [(line, None, f'Throughput Book {line}', THROUGHPUT_COPIES)
+                                     for line in range(1, args.books + 1)])
+            conn.close()
+            rates.append(run_counters(path, args, grouped))
+            problems = check_stock(path, THROUGHPUT_COPIES) + check_journal(path, THROUGHPUT_COPIES)
+            if problems:
+                print("Stock is inconsistent:")
+                for problem in problems[:20]:
+                    print(f"  {problem}")
+                sys.exit(1)
+        print(f"  Group commit is {rates[1] / rates[0]:.1f}x faster; stock and journal agree")
+
+
+def startup_probe(path, launched):
+    """Child process: start the application once and print when each milestone was reached"""
+    import tkinter as tk
+    spec = importlib.util.spec_from_file_location('library_app', APP_PATH)
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+
+    root = tk.Tk()
+    app = app_module.LibraryManagementApp(root, path)
+    reached = {}
+    deadline = time.time() + STARTUP_TIMEOUT
+    while len(reached) < len(STARTUP_MILESTONES) and time.time() < deadline:
+        root.update()
+        now = time.time()
+        if 'first_paint' not in reached and root.winfo_ismapped():
+            reached['first_paint'] = now
+        if 'table' not in reached and app.tree.get_children():
+            reached['table'] = now
+        if 'book_picker' not in reached and app.book_matches:
+            reached['book_picker'] = now
+        time.sleep(0.001)
+    app.db.close()
+    root.destroy()
+    print(json.dumps({name: (moment - launched) * 1000 for name, moment in reached.items()}))
+
+
+def startup_command(args):
+    """Time application startup at each scale against the first paint target"""
+    failed = False
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+        for scale in args.scales:
+            path = os.path.join(data_dir, f'benchmark_{scale}.db')
+            if not os.path.exists(path):
+                print(f"Generating {scale:,} loans in {path} ...")
+                generate_library(path, scale, random.Random(args.seed))
+
+            samples = {name: [] for name in STARTUP_MILESTONES}
+            for _ in range(args.runs):
+                # Measured from just before the process is launched, so the
+                # interpreter start and every import are included
+                launched = time.time()
+                probe = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                        '--startup-probe', path, repr(launched)],
+                                       capture_output=True, text=True)
+                if probe.returncode != 0:
+                    sys.exit(f"Startup probe failed:\n{probe.stderr}")
+                reached = json.loads(probe.stdout.strip().splitlines()[-1])
+                for name, ms in reached.items():
+                    samples[name].append(ms / 1000)
+            results = {name: summarize(values) for name, values in samples.items() if values}
+            print_results(scale, results)
+
+            first_paint = results.get('first_paint')
+            if first_paint is None or first_paint['p90'] > args.target:
+                failed = True
+
+    if failed:
+        print(f"\nFirst paint missed the {args.target:.0f} ms target")
+        sys.exit(1)
+    print(f"\nFirst paint within the {args.target:.0f} ms target")
+
+
+def latency_command(args):
+    """Benchmark every operation at each scale and compare against a baseline"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+        results = {}
+        for scale in args.scales:
+            rng = random.Random(args.seed)
+            path = os.path.join(data_dir, f'benchmark_{scale}.db')
+            if not os.path.exists(path):
+                print(f"Generating {scale:,} loans in {path} ...")
+                generate_library(path, scale, rng)
+            results[str(scale)] = run_scale(path, args.repeat, rng)
+            print_results(scale, results[str(scale)])
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library service layer")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="numbers of loans to generate (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help="samples per operation (default: %(default)s)")
+    parser.add_argument('--data-dir', help="keep generated databases here and reuse them")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--save', help="write the results to a JSON file")
+    parser.add_argument('--compare', help="fail if p90 regressed against a saved JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed p90 growth when comparing (default: %(default)s)")
+    parser.add_argument('--startup-probe', nargs=2, metavar=('DB', 'LAUNCHED'),
+                        help=argparse.SUPPRESS)
+    parser.set_defaults(handler=latency_command)
+    commands = parser.add_subparsers(title="commands")
+
+    stress_parser = commands.add_parser(
+        'stress', help="run concurrent checkout desks against one database file")
+    stress_parser.add_argument('--clients', type=int, default=8,
+                               help="number of desk processes (default: %(default)s)")
+    stress_parser.add_argument('--operations', type=int, default=300,
+                               help="checkouts and returns per desk (default: %(default)s)")
+    stress_parser.add_argument('--books', type=int, default=200,
+                               help="books in the catalog (default: %(default)s)")
+    stress_parser.add_argument('--hot', type=float, default=0.2,
+                               help="share of checkouts for the popular book "
+                                    "(default: %(default)s)")
+    stress_parser.set_defaults(handler=stress_command)
+
+    throughput_parser = commands.add_parser(
+        'throughput', help="compare checkout throughput with and without group commit")
+    throughput_parser.add_argument('--counters', type=int, default=8,
+                                   help="checkout counter threads (default: %(default)s)")
+    throughput_parser.add_argument('--operations', type=int, default=500,
+                                   help="checkouts and returns per counter (default: %(default)s)")
+    throughput_parser.add_argument('--books', type=int, default=1000,
+                                   help="books in the catalog (default: %(default)s)")
+    throughput_parser.add_argument('--synchronous', choices=('NORMAL', 'FULL'), default='FULL',
+                                   help="SQLite synchronous setting; FULL syncs every commit "
+                                        "to disk (default: %(default)s)")
+    throughput_parser.add_argument('--group-size', type=int, default=GROUP_COMMIT_SIZE,
+                                   help="requests per group at most (default: %(default)s)")
+    throughput_parser.add_argument('--window', type=float, default=GROUP_COMMIT_WINDOW * 1000,
+                                   help="ms a group waits for more requests (default: %(default)s)")
+    throughput_parser.set_defaults(handler=throughput_command)
+
+    startup_parser = commands.add_parser(
+        'startup', help="time how long the application window takes to appear and fill")
+    startup_parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                                help="numbers of loans to generate (default: %(default)s)")
+    startup_parser.add_argument('--runs', type=int, default=STARTUP_RUNS,
+                                help="application starts per scale (default: %(default)s)")
+    startup_parser.add_argument('--target', type=float, default=STARTUP_TARGET_MS,
+                                help="p90 first paint target in ms (default: %(default)s)")
+    startup_parser.set_defaults(handler=startup_command)
+
+    args = parser.parse_args()
+    if args.startup_probe:
+        db_path, launched = args.startup_probe
+        startup_probe(db_path, float(launched))
+        return
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Opt-in latency instrumentation for the library application.
+
+Nothing here runs unless profiling is switched on: the service methods, UI
+handlers and worker hooks are only wrapped when an Instrumentation object is
+created, so a normal run pays no cost at all.
+
+Every measurement goes into a per-name histogram with fixed millisecond
+buckets and can also be streamed to a JSON lines file, one object per event:
+
+    {"time": 1760000000.0, "kind": "query", "name": "count_loans", "ms": 1.8, "rows": null,
+     "failed": false}
+
+Calls that raise are timed too and counted as failures, so a query that times
+out or is interrupted still shows up in the latency it cost.
+"""
+import bisect
+import json
+import threading
+import time
+from functools import wraps
+
+# Histogram bucket upper bounds in milliseconds; slower samples go in a last bucket
+BUCKET_BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+                    2500, 5000)
+
+# The event loop is checked this often; a check this much late counts as a stall
+STALL_CHECK_MS = 50
+STALL_THRESHOLD_MS = 25
+
+# LibraryService methods timed as queries (row counts are recorded for lists)
+SERVICE_QUERIES = ('count_loans', 'fetch_loans', 'fetch_loans_from', 'loan_matches_search',
+                   'get_loan', 'search_books', 'get_book', 'get_books', 'borrow', 'borrow_many',
+                   'delete_loans', 'return_loans', 'compact_loans', 'recompute_fines',
+                   'circulation_stats', 'student_stats', 'book_stats')
+
+
+class Histogram:
+    """Latency histogram with fixed millisecond buckets"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.row_samples = 0
+        self.failures = 0
+
+    def add(self, ms, rows=None, failed=False):
+        """Count one sample"""
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.failures += failed
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if rows is not None:
+            self.rows += rows
+            self.row_samples += 1
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of samples"""
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        """Summarize the histogram as a dict of plain numbers"""
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.50),
+            'p90_ms': self.percentile(0.90),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_ms,
+            'mean_rows': self.rows / self.row_samples if self.row_samples else None,
+        }
+
+
+class Instrumentation:
+    """Collect latency histograms from any thread and optionally log every event.
+
+    Samples are grouped by (kind, name); kinds used by the application are
+    'query' (service calls on the worker thread), 'worker' (time jobs wait in
+    the queue), 'ui' (Tk handlers) and 'event loop' (stalls).
+    """
+
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.log_file = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    def record(self, kind, name, seconds, rows=None, failed=False):
+        """Add one measurement"""
+        ms = seconds * 1000
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.add(ms, rows, failed)
+            if self.log_file:
+                self.log_file.write(json.dumps({'time': time.time(), 'kind': kind,
+                                                'name': name, 'ms': round(ms, 3),
+                                                'rows': rows, 'failed': failed}) + '\n')
+
+    def timed(self, kind, name, function):
+        """Wrap a function so every call is recorded under (kind, name)"""
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(kind, name, time.perf_counter() - started,
+                            len(result) if isinstance(result, list) else None, failed)
+        return wrapper
+
+    def instrument_service(self, service):
+        """Time the query methods of one LibraryService instance and return it"""
+        for name in SERVICE_QUERIES:
+            setattr(service, name, self.timed('query', name, getattr(service, name)))
+        return service
+
+    def instrument_handlers(self, obj, names):
+        """Time the named methods of obj (call before they are bound to widgets)"""
+        for name in names:
+            setattr(obj, name, self.timed('ui', name, getattr(obj, name)))
+
+    def watch_event_loop(self, root):
+        """Record how late the Tk event loop runs a short periodic check"""
+        expected = time.perf_counter() + STALL_CHECK_MS / 1000
+
+        def check():
+            nonlocal expected
+            now = time.perf_counter()
+            late = now - expected
+            if late * 1000 >= STALL_THRESHOLD_MS:
+                self.record('event loop', 'stall', late)
+            expected = now + STALL_CHECK_MS / 1000
+            root.after(STALL_CHECK_MS, check)
+
+        root.after(STALL_CHECK_MS, check)
+
+    def snapshot(self):
+        """List a summary dict per (kind, name), slowest p90 first"""
+        with self.lock:
+            rows = [dict(kind=kind, name=name, **histogram.summary())
+                    for (kind, name), histogram in self.histograms.items()]
+        return sorted(rows, key=lambda row: row['p90_ms'], reverse=True)
+
+    def dump(self, path):
+        """Write the current summaries to a JSON lines file"""
+        now = time.time()
+        with open(path, 'w', encoding='utf-8') as dump_file:
+            for row in self.snapshot():
+                dump_file.write(json.dumps(dict(time=now, **row)) + '\n')
+
+    def reset(self):
+        """Forget every sample collected so far"""
+        with self.lock:
+            self.histograms = {}
+
+    def close(self):
+        """Flush and close the event log"""
+        with self.lock:
+            if self.log_file:
+                self.log_file.close()
+                self.log_file = None
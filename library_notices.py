@@ -0,0 +1,245 @@
+"""Reminder notices for loans that are due soon or overdue.
+
+Matching loans are streamed in due-date order from the open-loan return date
+index with fetchmany(), turned into notices one at a time by a chain of
+generators and written out as they come, so memory stays flat however many
+loans match. Notices go either to a directory, one text file per loan, or
+appended to an mbox spool for a mail transport to pick up.
+
+Before the first notice and after every batch the position reached (due
+date and loan id) is saved to an optional checkpoint file, so an interrupted
+run resumes where it stopped:
+
+    {"run": {"today": "2025-06-02", "days": 3, "kinds": ["overdue", "due-soon"]},
+     "position": ["2025-05-30", 8812], "counts": {"overdue": 500}, "spool": 412330}
+
+An mbox spool is cut back to the size recorded with the position before a
+resumed run appends to it, so no notice is sent twice.
+"""
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, namedtuple
+from datetime import date, datetime, timedelta
+from email.charset import QP, Charset
+from email.generator import BytesGenerator
+from email.header import Header
+from email.message import Message
+from email.utils import format_datetime, formataddr
+
+from library_service import (DATE_FORMAT, DISPLAY_DATE_FORMAT, FINE_PER_DAY, LOAN_SOURCE,
+                             OPEN_LOANS, calculate_fine)
+
+# Loans are read and the checkpoint is saved this many notices at a time
+NOTICE_BATCH_SIZE = 500
+
+# Default notice settings
+DUE_SOON_DAYS = 3
+NOTICE_KINDS = ('overdue', 'due-soon')
+NOTICE_SENDER = 'Library <library@localhost>'
+NOTICE_DOMAIN = 'localhost'
+
+# Notices are plain messages with preformatted headers: the email package's
+# parsing header objects would cost more than everything else put together
+NOTICE_CHARSET = Charset('utf-8')
+NOTICE_CHARSET.body_encoding = QP
+
+NOTICE_SUBJECTS = {
+    'overdue': "Overdue: {title}",
+    'due-soon': "Due {due}: {title}",
+}
+NOTICE_BODIES = {
+    'overdue': ("Dear {student},\n\n"
+                "\"{title}\" was due back on {due} and is now {days_late} day(s) overdue.\n"
+                "The fine so far is R{fine:.2f} and grows by R{rate:.2f} per day.\n"
+                "Please return it to the library as soon as possible.\n\n"
+                "Library\n"),
+    'due-soon': ("Dear {student},\n\n"
+                 "\"{title}\" is due back on {due}.\n"
+                 "Please return or renew it by then to avoid a fine of R{rate:.2f} per day.\n\n"
+                 "Library\n"),
+}
+
+# One notice per loan; position is its place in the stream for checkpoints
+Notice = namedtuple('Notice', 'kind loan_id student_name title return_date fine position')
+
+
+def notice_range(today, days, kinds):
+    """First and last due date (ISO text) covered by the notice kinds"""
+    due_soon_end = (today + timedelta(days=days)).strftime(DATE_FORMAT)
+    overdue_end = (today - timedelta(days=1)).strftime(DATE_FORMAT)
+    first = '' if 'overdue' in kinds else today.strftime(DATE_FORMAT)
+    last = due_soon_end if 'due-soon' in kinds else overdue_end
+    return first, last
+
+
+def find_notices(conn, today=None, days=DUE_SOON_DAYS, kinds=NOTICE_KINDS, position=None,
+                 rate=FINE_PER_DAY, batch_size=NOTICE_BATCH_SIZE):
+    """Yield a Notice per matching open loan in (due date, id) order, after position"""
+    today = today or date.today()
+    first, last = notice_range(today, days, kinds)
+    after_date, after_id = position or (first, 0)
+    cursor = conn.execute(f'''
+        SELECT bb.id, bb.student_name, b.title, bb.return_date FROM {LOAN_SOURCE}
+        WHERE {OPEN_LOANS} AND bb.return_date >= ? AND bb.return_date <= ?
+          AND (bb.return_date, bb.id) > (?, ?)
+        ORDER BY bb.return_date, bb.id
+    ''', (max(first, after_date), last, after_date, after_id))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for loan_id, student_name, title, return_date in rows:
+            due = datetime.strptime(return_date, DATE_FORMAT).date()
+            kind = 'overdue' if due < today else 'due-soon'
+            yield Notice(kind, loan_id, student_name, title, due,
+                         calculate_fine(due, today, rate), (return_date, loan_id))
+
+
+def notice_text(notice, today, rate=FINE_PER_DAY):
+    """The letter for one notice"""
+    return NOTICE_BODIES[notice.kind].format(
+        student=notice.student_name, title=notice.title,
+        due=notice.return_date.strftime(DISPLAY_DATE_FORMAT),
+        days_late=(today - notice.return_date).days, fine=notice.fine, rate=rate)
+
+
+def student_address(student_name, domain=NOTICE_DOMAIN):
+    """Mail address for a student: the name's letters and digits, unaccented, joined by dots"""
+    ascii_name = unicodedata.normalize('NFKD', student_name).encode('ascii', 'ignore').decode()
+    local_part = '.'.join(re.findall(r'[a-z0-9]+', ascii_name.lower())) or 'student'
+    return formataddr((student_name, f'{local_part}@{domain}'), 'utf-8')
+
+
+def render_notices(notices, today, rate=FINE_PER_DAY, sender=NOTICE_SENDER,
+                   domain=NOTICE_DOMAIN):
+    """Yield (notice, email message) for each notice, rendering only when asked for"""
+    sent = format_datetime(datetime.now().astimezone())
+    for notice in notices:
+        subject = NOTICE_SUBJECTS[notice.kind].format(
+            title=notice.title, due=notice.return_date.strftime(DISPLAY_DATE_FORMAT))
+        message = Message()
+        message['From'] = sender
+        message['To'] = student_address(notice.student_name, domain)
+        message['Date'] = sent
+        message['Subject'] = subject if subject.isascii() else Header(subject, 'utf-8')
+        message['X-Library-Loan'] = str(notice.loan_id)
+        message.set_payload(notice_text(notice, today, rate), NOTICE_CHARSET)
+        yield notice, message
+
+
+class DirectorySpool:
+    """Write each notice's letter to DIR/<kind>-<loan id>.txt; rewriting one is harmless"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def resume(self, state):
+        """Nothing to undo: files of notices after the checkpoint are simply rewritten"""
+
+    def write(self, notice, message):
+        """Write one notice"""
+        name = os.path.join(self.path, f'{notice.kind}-{notice.loan_id}.txt')
+        with open(name, 'w', encoding='utf-8') as notice_file:
+            notice_file.write(message.get_payload(decode=True).decode('utf-8'))
+
+    def flush(self):
+        """State to keep in the checkpoint (none)"""
+        return None
+
+    def close(self):
+        """Nothing to close"""
+
+
+class MboxSpool:
+    """Append notices to an mbox file, as a mail transport's spool"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+
+    def resume(self, state):
+        """Cut off notices written after the checkpoint was saved"""
+        if state is not None:
+            self.file.truncate(state)
+            self.file.seek(0, os.SEEK_END)
+
+    def write(self, notice, message):
+        """Append one message; body lines starting with 'From ' are escaped"""
+        self.file.write(f"From MAILER-DAEMON {time.asctime()}\n".encode('ascii'))
+        BytesGenerator(self.file, mangle_from_=True).flatten(message)
+        self.file.write(b'\n')
+
+    def flush(self):
+        """Put the messages written so far on disk and return the spool size"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        """Close the spool file"""
+        self.file.close()
+
+
+def load_checkpoint(path, run):
+    """Read a checkpoint for this run; None if there is none yet"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint['run'] != run:
+        raise ValueError(f"{path} belongs to another notice run ({checkpoint['run']}); "
+                         f"remove it to start again")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Replace the checkpoint file in one step, so a crash leaves the old or the new one"""
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary, path)
+
+
+def write_notices(conn, spool, today=None, days=DUE_SOON_DAYS, kinds=NOTICE_KINDS,
+                  checkpoint_path=None, rate=FINE_PER_DAY, sender=NOTICE_SENDER,
+                  domain=NOTICE_DOMAIN, batch_size=NOTICE_BATCH_SIZE):
+    """Stream the notices of one run into spool, resuming from its checkpoint.
+
+    Returns a Counter of the notices written per kind over the whole run,
+    including the parts written before a resume.
+    """
+    today = today or date.today()
+    run = {'today': today.strftime(DATE_FORMAT), 'days': days, 'kinds': list(kinds)}
+    checkpoint = load_checkpoint(checkpoint_path, run)
+    resumed = checkpoint is not None
+    if not resumed:
+        checkpoint = {'run': run, 'position': None, 'counts': {}, 'spool': None}
+    counts = Counter(checkpoint['counts'])
+    spool.resume(checkpoint['spool'])
+
+    def save(position):
+        checkpoint.update(position=position, counts=dict(counts), spool=spool.flush())
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    # Record where the spool starts before writing anything, so a run that
+    # stops inside its first batch is cut back to here too
+    if checkpoint_path and not resumed:
+        save(None)
+    position = checkpoint['position']
+    notices = find_notices(conn, today, days, kinds, position, rate, batch_size)
+    for written, (notice, message) in enumerate(
+            render_notices(notices, today, rate, sender, domain), 1):
+        spool.write(notice, message)
+        counts[notice.kind] += 1
+        position = notice.position
+        if written % batch_size == 0:
+            save(position)
+    save(position)
+    return counts
@@ -0,0 +1,1287 @@
+"""Library borrowing operations without any GUI code.
+
+The Tk application and the command line tools both go through this module,
+so every operation can also be scripted and benchmarked without a display.
+"""
+import csv
+import random
+import socket
+import sqlite3
+import time
+from collections import Counter, namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
+
+# Search settings. The trigram index needs 3 characters; shorter text finds
+# the names and titles that start with it through their sort indexes instead
+FULL_TEXT_MIN_LENGTH = 3
+SEARCH_COUNT_LIMIT = 10000
+BOOK_MATCH_LIMIT = 50
+
+# Row sources for the table; searches drive the join from the full-text index
+LOAN_SOURCE = 'borrowed_books bb JOIN books b ON bb.book_id = b.id'
+LOAN_SEARCH_SOURCE = ('loan_search s JOIN borrowed_books bb ON bb.id = s.rowid '
+                      'JOIN books b ON bb.book_id = b.id')
+
+# A full-text search shown in another order than the loan id keeps its matching
+# ids in a temporary table. Up to this many matches are read from it and sorted;
+# more are found by walking the sort order's index and probing the table.
+SORTED_SEARCH_SORT_LIMIT = 5000
+LOAN_MATCHES_SOURCE = ('temp.loan_search_matches m CROSS JOIN borrowed_books bb ON bb.id = m.id '
+                       'JOIN books b ON bb.book_id = b.id')
+
+
+# Dates are stored as sortable ISO text and shown to users as MM/DD/YY
+DATE_FORMAT = '%Y-%m-%d'
+DISPLAY_DATE_FORMAT = '%m/%d/%y'
+
+# Fine charged per day a book is overdue (R)
+FINE_PER_DAY = 5.0
+
+# Database settings
+DATABASE_PATH = 'library.db'
+DATABASE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",     # 64 MB page cache
+    "PRAGMA mmap_size = 268435456",   # map up to 256 MB of the file
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Several desks may share one database file. Writers wait this long for the
+# lock inside SQLite, then the whole transaction is retried with backoff.
+BUSY_TIMEOUT = 2.0          # seconds
+WRITE_RETRIES = 5
+WRITE_BACKOFF = 0.05        # seconds, doubled after every retry
+
+# Circulation journal entries name the desk that made the change
+DEFAULT_DESK = socket.gethostname()
+
+# Schema migrations. Migration N brings the database to user_version N;
+# append new migrations to the end and never edit one that has shipped.
+MIGRATIONS = [
+    # 1: books and loans
+    '''
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        quantity INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS borrowed_books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_name TEXT NOT NULL,
+        book_id INTEGER,
+        borrow_date TEXT NOT NULL,
+        return_date TEXT NOT NULL,
+        fine REAL DEFAULT 0,
+        FOREIGN KEY (book_id) REFERENCES books (id)
+    );
+    ''',
+
+    # 2: full-text search index over student names and book titles.
+    # The trigram tokenizer gives the same substring matching as LIKE '%x%'.
+    '''
+    CREATE VIRTUAL TABLE loan_search
+        USING fts5(student_name, title, tokenize='trigram');
+
+    INSERT INTO loan_search (rowid, student_name, title)
+    SELECT bb.id, bb.student_name, b.title
+    FROM borrowed_books bb
+    JOIN books b ON bb.book_id = b.id;
+
+    CREATE TRIGGER loan_search_insert
+    AFTER INSERT ON borrowed_books BEGIN
+        INSERT INTO loan_search (rowid, student_name, title)
+        VALUES (new.id, new.student_name,
+                (SELECT title FROM books WHERE id = new.book_id));
+    END;
+
+    CREATE TRIGGER loan_search_delete
+    AFTER DELETE ON borrowed_books BEGIN
+        DELETE FROM loan_search WHERE rowid = old.id;
+    END;
+
+    CREATE TRIGGER loan_search_update
+    AFTER UPDATE OF student_name, book_id ON borrowed_books BEGIN
+        UPDATE loan_search
+        SET student_name = new.student_name,
+            title = (SELECT title FROM books WHERE id = new.book_id)
+        WHERE rowid = new.id;
+    END;
+
+    CREATE TRIGGER loan_search_title_update
+    AFTER UPDATE OF title ON books BEGIN
+        UPDATE loan_search SET title = new.title
+        WHERE rowid IN (SELECT id FROM borrowed_books WHERE book_id = new.id);
+    END;
+    ''',
+
+    # 3: ISO dates so due-date ranges can be answered from an index
+    '''
+    UPDATE borrowed_books
+    SET borrow_date = iso_date(borrow_date),
+        return_date = iso_date(return_date);
+
+    CREATE INDEX idx_borrowed_books_return_date ON borrowed_books (return_date);
+    CREATE INDEX idx_borrowed_books_book_return_date ON borrowed_books (book_id, return_date);
+    ''',
+
+    # 4: type-ahead book picker; only books with copies left are indexed
+    '''
+    CREATE INDEX idx_books_available_title ON books (title COLLATE NOCASE)
+        WHERE quantity > 0;
+    ''',
+
+    # 5: stock can never go negative, whichever client writes it
+    '''
+    CREATE TRIGGER books_quantity_check
+    BEFORE UPDATE OF quantity ON books
+    WHEN new.quantity < 0 BEGIN
+        SELECT RAISE(ABORT, 'book quantity cannot be negative');
+    END;
+    ''',
+
+    # 6: returns. A returned loan keeps its row (returned_date is set) until
+    # compaction moves it to loan_history; the partial indexes let the table
+    # and compaction each read only their own rows.
+    '''
+    ALTER TABLE borrowed_books ADD COLUMN returned_date TEXT;
+
+    CREATE INDEX idx_borrowed_books_open ON borrowed_books (id)
+        WHERE returned_date IS NULL;
+    CREATE INDEX idx_borrowed_books_returned ON borrowed_books (id)
+        WHERE returned_date IS NOT NULL;
+
+    CREATE TABLE loan_history (
+        id INTEGER PRIMARY KEY,
+        student_name TEXT NOT NULL,
+        book_id INTEGER,
+        borrow_date TEXT NOT NULL,
+        return_date TEXT NOT NULL,
+        returned_date TEXT NOT NULL,
+        fine REAL DEFAULT 0
+    );
+
+    CREATE INDEX idx_loan_history_returned_date ON loan_history (returned_date);
+    CREATE INDEX idx_loan_history_book ON loan_history (book_id, returned_date);
+    CREATE INDEX idx_loan_history_student ON loan_history (student_name);
+
+    -- Returned loans leave the search index straight away
+    CREATE TRIGGER loan_search_return
+    AFTER UPDATE OF returned_date ON borrowed_books
+    WHEN new.returned_date IS NOT NULL BEGIN
+        DELETE FROM loan_search WHERE rowid = old.id;
+    END;
+    ''',
+
+    # 7: circulation statistics over the open loans, kept up to date by triggers
+    # so they can be read without scanning the loans. A loan is overdue when it
+    # carries a fine, as in the table.
+    '''
+    CREATE TABLE student_stats (
+        student_name TEXT PRIMARY KEY,
+        open_loans INTEGER NOT NULL,
+        outstanding_fines REAL NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE book_stats (
+        book_id INTEGER PRIMARY KEY,
+        active_loans INTEGER NOT NULL
+    );
+
+    CREATE TABLE circulation_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        active_loans INTEGER NOT NULL,
+        overdue_loans INTEGER NOT NULL,
+        outstanding_fines REAL NOT NULL
+    );
+
+    INSERT INTO student_stats
+    SELECT student_name, COUNT(*), TOTAL(fine) FROM borrowed_books
+    WHERE returned_date IS NULL GROUP BY student_name;
+
+    INSERT INTO book_stats
+    SELECT book_id, COUNT(*) FROM borrowed_books
+    WHERE returned_date IS NULL GROUP BY book_id;
+
+    INSERT INTO circulation_stats
+    SELECT 1, COUNT(*), COUNT(CASE WHEN fine > 0 THEN 1 END), TOTAL(fine)
+    FROM borrowed_books WHERE returned_date IS NULL;
+
+    CREATE TRIGGER stats_loan_insert
+    AFTER INSERT ON borrowed_books
+    WHEN new.returned_date IS NULL BEGIN
+        INSERT INTO student_stats VALUES (new.student_name, 1, IFNULL(new.fine, 0))
+        ON CONFLICT (student_name) DO UPDATE
+        SET open_loans = open_loans + 1,
+            outstanding_fines = outstanding_fines + excluded.outstanding_fines;
+
+        INSERT INTO book_stats VALUES (new.book_id, 1)
+        ON CONFLICT (book_id) DO UPDATE SET active_loans = active_loans + 1;
+
+        UPDATE circulation_stats
+        SET active_loans = active_loans + 1,
+            overdue_loans = overdue_loans + (IFNULL(new.fine, 0) > 0),
+            outstanding_fines = outstanding_fines + IFNULL(new.fine, 0);
+    END;
+
+    CREATE TRIGGER stats_loan_delete
+    AFTER DELETE ON borrowed_books
+    WHEN old.returned_date IS NULL BEGIN
+        UPDATE student_stats
+        SET open_loans = open_loans - 1,
+            outstanding_fines = outstanding_fines - IFNULL(old.fine, 0)
+        WHERE student_name = old.student_name;
+        DELETE FROM student_stats WHERE student_name = old.student_name AND open_loans = 0;
+
+        UPDATE book_stats SET active_loans = active_loans - 1 WHERE book_id = old.book_id;
+        DELETE FROM book_stats WHERE book_id = old.book_id AND active_loans = 0;
+
+        UPDATE circulation_stats
+        SET active_loans = active_loans - 1,
+            overdue_loans = overdue_loans - (IFNULL(old.fine, 0) > 0),
+            outstanding_fines = outstanding_fines - IFNULL(old.fine, 0);
+    END;
+
+    -- Fine recalculation only changes amounts, so it gets a cheaper trigger
+    CREATE TRIGGER stats_loan_fine
+    AFTER UPDATE OF fine ON borrowed_books
+    WHEN old.returned_date IS NULL AND new.returned_date IS NULL
+     AND old.student_name = new.student_name AND old.book_id IS new.book_id BEGIN
+        UPDATE student_stats
+        SET outstanding_fines = outstanding_fines + IFNULL(new.fine, 0) - IFNULL(old.fine, 0)
+        WHERE student_name = new.student_name;
+
+        UPDATE circulation_stats
+        SET overdue_loans = overdue_loans + (IFNULL(new.fine, 0) > 0)
+                                          - (IFNULL(old.fine, 0) > 0),
+            outstanding_fines = outstanding_fines + IFNULL(new.fine, 0) - IFNULL(old.fine, 0);
+    END;
+
+    -- Returns and any other change: take the old loan out, then put the new one in
+    CREATE TRIGGER stats_loan_update
+    AFTER UPDATE OF returned_date, fine, student_name, book_id ON borrowed_books
+    WHEN NOT (old.returned_date IS NULL AND new.returned_date IS NULL
+              AND old.student_name = new.student_name AND old.book_id IS new.book_id) BEGIN
+        UPDATE student_stats
+        SET open_loans = open_loans - 1,
+            outstanding_fines = outstanding_fines - IFNULL(old.fine, 0)
+        WHERE student_name = old.student_name AND old.returned_date IS NULL;
+        DELETE FROM student_stats WHERE student_name = old.student_name AND open_loans = 0;
+
+        UPDATE book_stats SET active_loans = active_loans - 1
+        WHERE book_id = old.book_id AND old.returned_date IS NULL;
+        DELETE FROM book_stats WHERE book_id = old.book_id AND active_loans = 0;
+
+        INSERT INTO student_stats
+        SELECT new.student_name, 1, IFNULL(new.fine, 0) WHERE new.returned_date IS NULL
+        ON CONFLICT (student_name) DO UPDATE
+        SET open_loans = open_loans + 1,
+            outstanding_fines = outstanding_fines + excluded.outstanding_fines;
+
+        INSERT INTO book_stats
+        SELECT new.book_id, 1 WHERE new.returned_date IS NULL
+        ON CONFLICT (book_id) DO UPDATE SET active_loans = active_loans + 1;
+
+        UPDATE circulation_stats
+        SET active_loans = active_loans - (old.returned_date IS NULL)
+                                        + (new.returned_date IS NULL),
+            overdue_loans = overdue_loans
+                - (old.returned_date IS NULL AND IFNULL(old.fine, 0) > 0)
+                + (new.returned_date IS NULL AND IFNULL(new.fine, 0) > 0),
+            outstanding_fines = outstanding_fines
+                - CASE WHEN old.returned_date IS NULL THEN IFNULL(old.fine, 0) ELSE 0 END
+                + CASE WHEN new.returned_date IS NULL THEN IFNULL(new.fine, 0) ELSE 0 END;
+    END;
+    ''',
+
+    # 8: sortable table columns. Each sort key has an index over the open loans
+    # that ends in the loan id (the rowid), so keyset pages in any order are
+    # index seeks. Sort keys cannot be NULL.
+    '''
+    UPDATE borrowed_books SET fine = 0 WHERE fine IS NULL;
+
+    CREATE INDEX idx_borrowed_books_open_student
+        ON borrowed_books (student_name COLLATE NOCASE) WHERE returned_date IS NULL;
+    CREATE INDEX idx_borrowed_books_open_book
+        ON borrowed_books (book_id) WHERE returned_date IS NULL;
+    CREATE INDEX idx_borrowed_books_open_borrow_date
+        ON borrowed_books (borrow_date) WHERE returned_date IS NULL;
+    CREATE INDEX idx_borrowed_books_open_return_date
+        ON borrowed_books (return_date) WHERE returned_date IS NULL;
+    CREATE INDEX idx_borrowed_books_open_fine
+        ON borrowed_books (fine) WHERE returned_date IS NULL;
+    CREATE INDEX idx_books_title ON books (title COLLATE NOCASE);
+    ''',
+
+    # 9: change log for in-memory snapshots of the open loans (library_snapshot).
+    # Every change to an open loan appends its id with a new sequence number, so
+    # a snapshot re-reads only the loans changed since the last number it saw.
+    # AUTOINCREMENT keeps numbers from being reused after the log is pruned.
+    '''
+    CREATE TABLE loan_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        loan_id INTEGER NOT NULL
+    );
+
+    CREATE TRIGGER loan_changes_insert
+    AFTER INSERT ON borrowed_books
+    WHEN new.returned_date IS NULL BEGIN
+        INSERT INTO loan_changes (loan_id) VALUES (new.id);
+    END;
+
+    -- Covers returns too: the loan was open before the update
+    CREATE TRIGGER loan_changes_update
+    AFTER UPDATE ON borrowed_books
+    WHEN old.returned_date IS NULL OR new.returned_date IS NULL BEGIN
+        INSERT INTO loan_changes (loan_id) VALUES (old.id);
+    END;
+
+    -- Compaction deletes returned loans only, which were logged when returned
+    CREATE TRIGGER loan_changes_delete
+    AFTER DELETE ON borrowed_books
+    WHEN old.returned_date IS NULL BEGIN
+        INSERT INTO loan_changes (loan_id) VALUES (old.id);
+    END;
+
+    CREATE TRIGGER loan_changes_title
+    AFTER UPDATE OF title ON books BEGIN
+        INSERT INTO loan_changes (loan_id)
+        SELECT id FROM borrowed_books
+        WHERE book_id = new.id AND returned_date IS NULL;
+    END;
+    ''',
+
+    # 10: circulation journal, an audit trail of every checkout, return and
+    # deletion: when, at which desk, and how it changed the book's stock. It is
+    # written in the same transaction as the change itself and never rewritten.
+    '''
+    CREATE TABLE circulation_journal (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recorded TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+        desk TEXT NOT NULL,
+        action TEXT NOT NULL,
+        loan_id INTEGER NOT NULL,
+        book_id INTEGER,
+        student_name TEXT,
+        stock_change INTEGER NOT NULL,
+        fine REAL
+    );
+
+    CREATE INDEX idx_circulation_journal_book ON circulation_journal (book_id);
+
+    CREATE TRIGGER circulation_journal_no_update
+    BEFORE UPDATE ON circulation_journal BEGIN
+        SELECT RAISE(ABORT, 'the circulation journal is append-only');
+    END;
+
+    CREATE TRIGGER circulation_journal_no_delete
+    BEFORE DELETE ON circulation_journal BEGIN
+        SELECT RAISE(ABORT, 'the circulation journal is append-only');
+    END;
+    ''',
+]
+
+# How each statistics table is computed from scratch, for the consistency check.
+# Columns after the key are compared; amounts may differ by rounding only.
+STATS_QUERIES = {
+    'student_stats': '''
+        SELECT student_name, COUNT(*), TOTAL(fine) FROM borrowed_books
+        WHERE returned_date IS NULL GROUP BY student_name
+    ''',
+    'book_stats': '''
+        SELECT book_id, COUNT(*) FROM borrowed_books
+        WHERE returned_date IS NULL GROUP BY book_id
+    ''',
+    'circulation_stats': '''
+        SELECT 1, COUNT(*), COUNT(CASE WHEN fine > 0 THEN 1 END), TOTAL(fine)
+        FROM borrowed_books WHERE returned_date IS NULL
+    ''',
+}
+STATS_TOLERANCE = 1e-6
+
+# Closed loans are moved to loan_history this many rows per transaction
+COMPACT_BATCH_SIZE = 1000
+
+# Compaction also trims the loan change log to this many latest entries; a
+# snapshot that fell further behind reloads in full
+LOAN_CHANGES_KEPT = 100000
+
+# Bulk CSV import/export settings
+CSV_BATCH_SIZE = 10000
+CSV_COLUMNS = {
+    'books': ('id', 'title', 'quantity'),
+    'loans': ('id', 'student_name', 'book_id', 'borrow_date', 'return_date', 'fine'),
+    'history': ('id', 'student_name', 'book_id', 'borrow_date', 'return_date',
+                'returned_date', 'fine'),
+    'journal': ('id', 'recorded', 'desk', 'action', 'loan_id', 'book_id', 'student_name',
+                'stock_change', 'fine'),
+}
+CSV_IMPORT_TABLES = ('books', 'loans')
+CSV_OPTIONAL_COLUMNS = {'id', 'fine'}
+HISTORY_COLUMNS = ', '.join(CSV_COLUMNS['history'])
+CSV_SOURCES = {
+    'books': 'books',
+    'loans': 'borrowed_books WHERE returned_date IS NULL',
+    # Returned loans that have not been compacted yet are history too
+    'history': (f'(SELECT {HISTORY_COLUMNS} FROM loan_history UNION ALL '
+                f'SELECT {HISTORY_COLUMNS} FROM borrowed_books WHERE returned_date IS NOT NULL)'),
+    'journal': 'circulation_journal',
+}
+
+# Only loans that are still out are listed, searched and fined
+OPEN_LOANS = 'bb.returned_date IS NULL'
+
+# Short search text matches names and titles that start with it (case-insensitive).
+# The parameters are the prefix and its upper bound, for the name and the title.
+PREFIX_SEARCH_CLAUSE = (
+    f'{OPEN_LOANS} AND ((bb.student_name COLLATE NOCASE >= ? '
+    'AND bb.student_name COLLATE NOCASE < ?) '
+    'OR (b.title COLLATE NOCASE >= ? AND b.title COLLATE NOCASE < ?))')
+
+# Loans matching a prefix search, each side a range seek on its NOCASE index
+PREFIX_SEARCH_MATCHES = f'''
+    SELECT id FROM (
+        SELECT bb.id FROM borrowed_books bb
+        WHERE {OPEN_LOANS}
+          AND bb.student_name COLLATE NOCASE >= ? AND bb.student_name COLLATE NOCASE < ?
+        LIMIT ?
+    )
+    UNION
+    SELECT id FROM (
+        SELECT bb.id FROM books b CROSS JOIN borrowed_books bb ON bb.book_id = b.id
+        WHERE {OPEN_LOANS} AND b.title COLLATE NOCASE >= ? AND b.title COLLATE NOCASE < ?
+        LIMIT ?
+    )
+    LIMIT ?
+'''
+
+# A table filter: row source, keyset column, WHERE clause and its parameters
+LoanSearch = namedtuple('LoanSearch', 'source key clause params')
+NO_SEARCH = LoanSearch(LOAN_SOURCE, 'bb.id', '', ())
+
+# Table sort orders: the columns a table is sorted by and the record fields that
+# hold their values. The search key (the loan id) always follows as the last
+# column, so every record has a unique position for keyset pagination.
+LOAN_ORDERS = {
+    'id': ((), ()),
+    'student': (('bb.student_name COLLATE NOCASE',), (1,)),
+    'book': (('b.title COLLATE NOCASE', 'bb.book_id'), (2, 6)),
+    'borrow_date': (('bb.borrow_date',), (3,)),
+    'return_date': (('bb.return_date',), (4,)),
+    'fine': (('bb.fine',), (5,)),
+}
+
+# Sorting by title walks the books' title index, so the books must drive the join
+LOAN_SOURCE_BY_TITLE = 'books b CROSS JOIN borrowed_books bb ON bb.book_id = b.id'
+
+# A table sort order: a LOAN_ORDERS name and its direction
+LoanOrder = namedtuple('LoanOrder', 'name descending')
+ID_ORDER = LoanOrder('id', False)
+
+
+class LibraryError(Exception):
+    """A borrowing rule was broken; the message is meant for the user"""
+
+
+def is_busy_error(error):
+    """Check whether an sqlite3 error means another client holds the write lock"""
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def to_iso_date(display_date):
+    """Convert a MM/DD/YY date to the stored YYYY-MM-DD form"""
+    return datetime.strptime(display_date, DISPLAY_DATE_FORMAT).strftime(DATE_FORMAT)
+
+
+def to_display_date(iso_date):
+    """Convert a stored YYYY-MM-DD date to the MM/DD/YY display form"""
+    try:
+        return datetime.strptime(iso_date, DATE_FORMAT).strftime(DISPLAY_DATE_FORMAT)
+    except ValueError:
+        # Legacy rows that never held a valid date are shown as stored
+        return iso_date
+
+
+def sql_iso_date(value):
+    """SQL iso_date(): convert MM/DD/YY text, leaving anything else untouched"""
+    try:
+        return to_iso_date(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def calculate_fine(return_date, today=None, rate=FINE_PER_DAY):
+    """Calculate the fine for a loan due on return_date (rate per day late)"""
+    today = today or date.today()
+    if return_date < today:
+        return (today - return_date).days * rate
+    return 0.0
+
+
+def build_search(text):
+    """Turn search box text into a LoanSearch filter"""
+    text = text.strip().lower()
+    if len(text) >= FULL_TEXT_MIN_LENGTH:
+        # Substring match through the trigram full-text index
+        phrase = '"' + text.replace('"', '""') + '"'
+        return LoanSearch(LOAN_SEARCH_SOURCE, 's.rowid',
+                          f'loan_search MATCH ? AND {OPEN_LOANS}', (phrase,))
+    if text:
+        # Too short for trigrams: match the start of names and titles instead.
+        # Every string starting with text sorts before text + the last code point.
+        bounds = (text, text + '\U0010ffff')
+        return LoanSearch(LOAN_SOURCE, 'bb.id', PREFIX_SEARCH_CLAUSE, bounds + bounds)
+    return NO_SEARCH
+
+
+def order_position(order, record):
+    """A record's position in a sort order: its sort column values, then its id"""
+    return tuple(record[field] for field in LOAN_ORDERS[order.name][1]) + (record[0],)
+
+
+def order_source(search, order):
+    """The row source that reads a search's records in a sort order"""
+    if order.name == 'book' and search.source == LOAN_SOURCE:
+        return LOAN_SOURCE_BY_TITLE
+    return search.source
+
+
+def connect_database(path=DATABASE_PATH):
+    """Open the library database, tune it and bring its schema up to date"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    for pragma in DATABASE_PRAGMAS:
+        conn.execute(pragma)
+    conn.create_function('iso_date', 1, sql_iso_date, deterministic=True)
+    migrate_database(conn)
+    return conn
+
+
+def script_statements(script):
+    """Split an SQL script into its statements, keeping trigger bodies whole"""
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \t\n;'):
+                yield statement
+            statement = ''
+
+
+def migrate_database(conn):
+    """Apply pending schema migrations, each in its own transaction.
+
+    An up-to-date database only has its user_version read, so opening a large
+    library never scans or rewrites tables. user_version is read again once the
+    write lock is held, so when several clients open an old database at once,
+    each migration is applied by one of them and the others skip it.
+    """
+    while conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        # executescript() would commit first, so the statements run one by one
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                for statement in script_statements(MIGRATIONS[version]):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def seed_database(conn):
+    """Insert sample books and borrowed records"""
+    cursor = conn.cursor()
+
+    # Insert sample books
+    sample_books = [
+        ('Introduction to Python', 3),
+        ('Data Structures and Algorithms', 2),
+        ('Machine Learning Fundamentals', 4),
+        ('Database Systems', 1),
+        ('Web Development with Django', 2)
+    ]
+
+    cursor.executemany(
+        "INSERT INTO books (title, quantity) VALUES (?, ?)",
+        sample_books
+    )
+    first_book_id = cursor.execute("SELECT MAX(id) FROM books").fetchone()[0] - len(sample_books) + 1
+
+    # Insert sample borrowed records
+    sample_borrowed = [
+        ('John Smith', first_book_id, '2025-06-15', '2025-06-25', 0),
+        ('Emma Wilson', first_book_id + 1, '2025-06-18', '2025-06-28', 0),
+        ('Michael Brown', first_book_id + 2, '2025-06-10', '2025-06-20', 25.0)
+    ]
+    cursor.executemany(
+        '''INSERT INTO borrowed_books 
+        (student_name, book_id, borrow_date, return_date, fine) 
+        VALUES (?, ?, ?, ?, ?)''',
+        sample_borrowed
+    )
+
+    conn.commit()
+
+
+def recompute_fines(conn, rate=FINE_PER_DAY, today=None):
+    """Recompute every stored fine of the open loans for the given day.
+
+    Overdue loans are found through the return_date index and charged rate per
+    day late; loans that are not overdue (any more) are reset to 0. Rows whose
+    fine is already correct and returned loans, whose fine is final, are left
+    alone. Returns the number of rows changed.
+    """
+    today = (today or date.today()).strftime(DATE_FORMAT)
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE borrowed_books
+        SET fine = (julianday(?) - julianday(return_date)) * ?
+        WHERE return_date < ? AND returned_date IS NULL
+          AND fine IS NOT (julianday(?) - julianday(return_date)) * ?
+    ''', (today, rate, today, today, rate))
+    changed = cursor.rowcount
+    cursor.execute('''
+        UPDATE borrowed_books SET fine = 0
+        WHERE return_date >= ? AND returned_date IS NULL AND fine != 0
+    ''', (today,))
+    changed += cursor.rowcount
+    conn.commit()
+    return changed
+
+
+def check_stats(conn):
+    """Recompute the statistics tables from the loans and list every difference"""
+    differences = []
+    for table, query in STATS_QUERIES.items():
+        expected = {row[0]: row[1:] for row in conn.execute(query)}
+        maintained = {row[0]: row[1:] for row in conn.execute(f"SELECT * FROM {table}")}
+        for key in sorted(expected.keys() | maintained.keys(), key=str):
+            want, have = expected.get(key), maintained.get(key)
+            if want is None or have is None or any(
+                    abs(a - b) > STATS_TOLERANCE for a, b in zip(want, have)):
+                differences.append(f"{table} {key!r}: expected {want}, found {have}")
+    return differences
+
+
+def rebuild_stats(conn):
+    """Replace the statistics tables with values recomputed from the loans"""
+    with conn:
+        for table, query in STATS_QUERIES.items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} {query}")
+
+
+@lru_cache(maxsize=4096)
+def parse_csv_date(value):
+    """Parse a CSV date given as YYYY-MM-DD or MM/DD/YY into the stored form.
+
+    Loan files repeat the same few thousand dates, so results are cached.
+    """
+    try:
+        if len(value) == 10 and value[4] == '-':
+            date.fromisoformat(value)
+            return value
+        return to_iso_date(value)
+    except ValueError:
+        raise ValueError(f"invalid date {value!r}") from None
+
+
+def parse_book_row(row):
+    """Validate a books CSV row and return the values to insert"""
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ValueError("missing title")
+    quantity = int(row['quantity'])
+    if quantity < 0:
+        raise ValueError("quantity cannot be negative")
+    return (int(row['id']) if row.get('id') else None, title, quantity)
+
+
+def parse_loan_row(row):
+    """Validate a loans CSV row and return the values to insert"""
+    student_name = (row.get('student_name') or '').strip()
+    if not student_name:
+        raise ValueError("missing student name")
+    borrow_date = parse_csv_date(row['borrow_date'])
+    return_date = parse_csv_date(row['return_date'])
+    if return_date < borrow_date:
+        raise ValueError("return date is before borrow date")
+    return (int(row['id']) if row.get('id') else None, student_name, int(row['book_id']),
+            borrow_date, return_date, float(row['fine']) if row.get('fine') else 0.0)
+
+
+def insert_book_batch(conn, rows):
+    """Insert one batch of validated (line, id, title, quantity) rows in a transaction"""
+    with conn:
+        return conn.executemany(
+            "INSERT INTO books (id, title, quantity) VALUES (?, ?, ?)",
+            [row[1:] for row in rows]
+        ).rowcount
+
+
+def insert_loan_batch(conn, rows, on_reject):
+    """Insert one batch of validated loan rows in a transaction.
+
+    Rows are (line, id, student_name, book_id, borrow_date, return_date, fine).
+    They are staged first so book ids are checked with one query and the search
+    index is filled by one INSERT ... SELECT instead of statement by statement.
+    Rows with unknown book ids, or with the id of a loan already archived in the
+    loan history, are reported through on_reject(line, reason).
+    """
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS loan_import (
+            line INTEGER, id INTEGER, student_name TEXT, book_id INTEGER,
+            borrow_date TEXT, return_date TEXT, fine REAL
+        )
+    ''')
+    with conn:
+        conn.executemany("INSERT INTO temp.loan_import VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+        # Validate book references for the whole batch at once
+        for line, book_id in conn.execute('''
+            SELECT line, book_id FROM temp.loan_import
+            WHERE book_id NOT IN (SELECT id FROM books)
+        '''):
+            on_reject(line, f"unknown book id {book_id}")
+
+        # An archived id would make compact_loans fail on this loan forever
+        for line, loan_id in conn.execute('''
+            SELECT line, id FROM temp.loan_import i
+            WHERE book_id IN (SELECT id FROM books)
+              AND EXISTS (SELECT 1 FROM loan_history h WHERE h.id = i.id)
+        '''):
+            on_reject(line, f"loan id {loan_id} is already in the loan history")
+
+        inserted = conn.execute('''
+            INSERT INTO borrowed_books (id, student_name, book_id, borrow_date, return_date, fine)
+            SELECT id, student_name, book_id, borrow_date, return_date, fine
+            FROM temp.loan_import i
+            WHERE book_id IN (SELECT id FROM books)
+              AND NOT EXISTS (SELECT 1 FROM loan_history h WHERE h.id = i.id)
+            ORDER BY line
+        ''').rowcount
+        conn.execute("DELETE FROM temp.loan_import")
+    return inserted
+
+
+def import_csv(conn, table, csv_file, on_reject, batch_size=CSV_BATCH_SIZE):
+    """Stream a books or loans CSV file into the database in batched transactions.
+
+    Rows are read batch_size at a time, so memory use does not grow with the
+    file. Invalid rows (bad values or dates, unknown book ids, ids of archived
+    loans) are skipped and reported through on_reject(line, reason). Returns the
+    number of rows imported.
+    """
+    reader = csv.DictReader(csv_file)
+    missing = set(CSV_COLUMNS[table]) - CSV_OPTIONAL_COLUMNS - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV file is missing columns: {', '.join(sorted(missing))}")
+
+    imported = 0
+    while True:
+        batch = list(islice(reader, batch_size))
+        if not batch:
+            break
+
+        # Validate values and dates
+        rows = []
+        first_line = reader.line_num - len(batch) + 1
+        for line, row in enumerate(batch, start=first_line):
+            try:
+                if table == 'books':
+                    rows.append((line,) + parse_book_row(row))
+                else:
+                    rows.append((line,) + parse_loan_row(row))
+            except (KeyError, TypeError, ValueError) as e:
+                on_reject(line, str(e))
+
+        if table == 'books':
+            imported += insert_book_batch(conn, rows)
+        else:
+            imported += insert_loan_batch(conn, rows, on_reject)
+
+    return imported
+
+
+def export_csv(conn, table, csv_file, batch_size=CSV_BATCH_SIZE):
+    """Stream books, open loans, loan history or the journal to a CSV file in batches"""
+    columns = CSV_COLUMNS[table]
+    writer = csv.writer(csv_file)
+    writer.writerow(columns)
+
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {CSV_SOURCES[table]} ORDER BY id")
+    exported = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        writer.writerows(rows)
+        exported += len(rows)
+    return exported
+
+
+class LibraryService:
+    """Borrowing operations on one database connection.
+
+    Methods raise LibraryError when a borrowing rule is broken and let
+    sqlite3 errors propagate. Checkouts, returns and deletions are recorded
+    in the circulation journal under the service's desk name. A service must
+    only be used from the thread that opened it.
+    """
+
+    def __init__(self, conn, fine_rate=FINE_PER_DAY, desk=DEFAULT_DESK):
+        self.conn = conn
+        self.fine_rate = fine_rate
+        self.desk = desk
+        self.busy_retries = 0
+        self.in_group = False
+        self.search_matches = None  # (search, data stamp, match count)
+
+    @classmethod
+    def open(cls, path=DATABASE_PATH, fine_rate=FINE_PER_DAY, desk=DEFAULT_DESK):
+        """Connect to (and migrate) a database file"""
+        return cls(connect_database(path), fine_rate, desk)
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+    def write(self, work):
+        """Run work(cursor) in one write transaction and return its result.
+
+        BEGIN IMMEDIATE takes the write lock before anything is read, so a
+        transaction never has to be upgraded halfway and fail. If another
+        client keeps the lock past the busy timeout, the whole transaction is
+        retried with jittered exponential backoff. Inside write_group() the
+        work runs in a savepoint of the group's transaction instead.
+        """
+        if self.in_group:
+            return self.savepoint(work)
+        delay = WRITE_BACKOFF
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    result = work(cursor)
+                    self.conn.commit()
+                    return result
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == WRITE_RETRIES:
+                    raise
+                self.busy_retries += 1
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
+
+    def savepoint(self, work):
+        """Run work(cursor) in a savepoint of the open transaction; undo it if it fails"""
+        cursor = self.conn.cursor()
+        cursor.execute("SAVEPOINT request")
+        try:
+            result = work(cursor)
+        except BaseException:
+            cursor.execute("ROLLBACK TO request")
+            cursor.execute("RELEASE request")
+            raise
+        cursor.execute("RELEASE request")
+        return result
+
+    def write_group(self, requests):
+        """Run several request(service) calls in one write transaction with one commit.
+
+        Each request writes in its own savepoint, so a request that breaks a
+        borrowing rule is undone alone and the others still commit. Returns a
+        (result, error) pair per request, in order. Any other error fails the
+        whole group, which is retried as one when the lock is busy.
+        """
+        def run(cursor):
+            self.in_group = True
+            try:
+                outcomes = []
+                for request in requests:
+                    try:
+                        outcomes.append((request(self), None))
+                    except (LibraryError, sqlite3.IntegrityError) as e:
+                        outcomes.append((None, e))
+                return outcomes
+            finally:
+                self.in_group = False
+
+        return self.write(run)
+
+    def journal(self, cursor, action, entries):
+        """Append (loan id, book id, student, stock change, fine) entries to the journal"""
+        cursor.executemany('''
+            INSERT INTO circulation_journal
+                (desk, action, loan_id, book_id, student_name, stock_change, fine)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(self.desk, action) + entry for entry in entries])
+
+    def search_books(self, prefix='', limit=BOOK_MATCH_LIMIT):
+        """List (id, title, quantity) of available books whose title starts with prefix.
+
+        Matching ignores ASCII case and is answered from a range scan of the
+        available-title index, so it stays fast for very large catalogs.
+        """
+        return self.conn.execute('''
+            SELECT id, title, quantity FROM books
+            WHERE quantity > 0
+              AND title >= ? COLLATE NOCASE AND title < ? COLLATE NOCASE
+            ORDER BY title COLLATE NOCASE
+            LIMIT ?
+        ''', (prefix, prefix + '\U0010ffff', limit)).fetchall()
+
+    def get_book(self, book_id):
+        """Fetch (id, title, quantity) of one book, or None if it does not exist"""
+        return self.conn.execute(
+            "SELECT id, title, quantity FROM books WHERE id = ?", (book_id,)
+        ).fetchone()
+
+    def get_books(self, book_ids):
+        """Fetch (id, title, quantity) of the given books"""
+        book_ids = tuple(book_ids)
+        return self.conn.execute(f'''
+            SELECT id, title, quantity FROM books
+            WHERE id IN ({', '.join('?' * len(book_ids))})
+        ''', book_ids).fetchall()
+
+    def count_loans(self, search=NO_SEARCH):
+        """Count the records matching a search without fetching them"""
+        if search.clause == PREFIX_SEARCH_CLAUSE:
+            # Prefix matches are collected (up to the cap) for paging anyway
+            return self.search_match_count(search)
+        if search.clause:
+            # Counting every hit of a common word is slow, so stop at a cap
+            return self.conn.execute(f'''
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM {search.source}
+                    WHERE {search.clause}
+                    LIMIT ?
+                )
+            ''', search.params + (SEARCH_COUNT_LIMIT,)).fetchone()[0]
+        # Count what the table fetches: open loans whose book exists. book_stats
+        # (migration 7) has the open loans per book, so this reads one row per
+        # book instead of every loan
+        return self.conn.execute('''
+            SELECT IFNULL(SUM(s.active_loans), 0)
+            FROM book_stats s CROSS JOIN books b ON b.id = s.book_id
+        ''').fetchone()[0]
+
+    def fetch_loans(self, search, operator, position, limit, descending=False, order=ID_ORDER):
+        """Fetch a page of records using keyset pagination in a sort order.
+
+        position is the order_position of the record to page from. '>' and '>='
+        fetch the records after it; '<' and '<=' with descending=True fetch
+        those before it. Either way the page comes back in table order.
+        """
+        search = self.sorted_search(search, order)
+        columns = LOAN_ORDERS[order.name][0] + (search.key,)
+        if order.descending:
+            operator = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}[operator]
+        direction = 'DESC' if descending != order.descending else 'ASC'
+        query = f'''
+            SELECT bb.id, bb.student_name, b.title, bb.borrow_date, bb.return_date, bb.fine,
+                   bb.book_id
+            FROM {order_source(search, order)}
+            WHERE {search.clause or OPEN_LOANS} AND {{}}
+            ORDER BY {', '.join(f'{column} {direction}' for column in columns)}
+            LIMIT ?
+        '''
+
+        if search.source == LOAN_MATCHES_SOURCE:
+            # Few matches: sort them all in one pass
+            comparison = (f"({', '.join(columns)}) {operator} "
+                          f"({', '.join('?' * len(columns))})")
+            records = self.conn.execute(query.format(comparison),
+                                        search.params + position + (limit,)).fetchall()
+        else:
+            # A row-value comparison only seeks on its first column, which is slow
+            # when many records share a value (most fines are 0). Instead, page
+            # level by level: the ties on every column but the last, then on one
+            # column fewer, and so on, each one an index seek.
+            records = []
+            for level in range(len(columns) - 1, -1, -1):
+                # Only the last column may include the starting record itself
+                last = operator if level == len(columns) - 1 else operator[0]
+                comparison = ' AND '.join([f'{column} = ?' for column in columns[:level]]
+                                          + [f'{columns[level]} {last} ?'])
+                records += self.conn.execute(
+                    query.format(comparison),
+                    search.params + position[:level + 1] + (limit - len(records),)).fetchall()
+                if len(records) == limit:
+                    break
+        return records[::-1] if descending else records
+
+    def search_match_count(self, search):
+        """Copy the ids matching a search to a temporary table and return how many.
+
+        The table is only refilled once the search or the data has changed.
+        Prefix matches stop at SEARCH_COUNT_LIMIT.
+        """
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        cached = self.search_matches
+        if cached is None or cached[:2] != (search, (self.conn.total_changes, data_version)):
+            self.conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS loan_search_matches (id INTEGER PRIMARY KEY)
+            ''')
+            self.conn.execute('DELETE FROM temp.loan_search_matches')
+            if search.clause == PREFIX_SEARCH_CLAUSE:
+                bounds = search.params[:2]
+                count = self.conn.execute(
+                    f'INSERT INTO temp.loan_search_matches {PREFIX_SEARCH_MATCHES}',
+                    bounds + (SEARCH_COUNT_LIMIT,) + bounds + (SEARCH_COUNT_LIMIT,)
+                    + (SEARCH_COUNT_LIMIT,)).rowcount
+            else:
+                count = self.conn.execute('''
+                    INSERT INTO temp.loan_search_matches
+                    SELECT rowid FROM loan_search WHERE loan_search MATCH ?
+                ''', search.params).rowcount
+            self.conn.commit()
+            # Filling the table counts as changes too, so stamp the data afterwards
+            cached = self.search_matches = (search, (self.conn.total_changes, data_version),
+                                            count)
+        return cached[2]
+
+    def sorted_search(self, search, order):
+        """Turn a search into one that can be paged in a sort order.
+
+        Full-text matches come out in id order only, so for other orders their
+        ids are copied to a temporary table. Prefix matches come from two
+        indexes at once and are always read from that table.
+        """
+        prefix = search.clause == PREFIX_SEARCH_CLAUSE
+        if not prefix and (order.name == 'id' or search.source != LOAN_SEARCH_SOURCE):
+            return search
+
+        # Prefix matches are capped, so there are never too many to sort
+        if self.search_match_count(search) <= SORTED_SEARCH_SORT_LIMIT or prefix:
+            return LoanSearch(LOAN_MATCHES_SOURCE, 'm.id', OPEN_LOANS, ())
+        # The unary + keeps SQLite from driving the query from the matches
+        return LoanSearch(LOAN_SOURCE, 'bb.id',
+                          f'{OPEN_LOANS} AND +bb.id IN (SELECT id FROM temp.loan_search_matches)',
+                          ())
+
+    def find_anchor(self, search, offset, order=ID_ORDER):
+        """Find the position of the record at a row offset (used when the scrollbar jumps)"""
+        search = self.sorted_search(search, order)
+        columns = LOAN_ORDERS[order.name][0] + (search.key,)
+        if search.clause or order.name == 'book':
+            source = order_source(search, order)
+        else:
+            # Counting off open loans needs no book titles
+            source = 'borrowed_books bb'
+        direction = 'DESC' if order.descending else 'ASC'
+        result = self.conn.execute(f'''
+            SELECT {', '.join(columns)}
+            FROM {source}
+            WHERE {search.clause or OPEN_LOANS}
+            ORDER BY {', '.join(f'{column} {direction}' for column in columns)}
+            LIMIT 1 OFFSET ?
+        ''', search.params + (offset,)).fetchone()
+        return tuple(result) if result else None
+
+    def fetch_loans_from(self, search, offset, limit, order=ID_ORDER):
+        """Fetch a page of records starting at a row offset"""
+        position = self.find_anchor(search, offset, order)
+        if position is None:
+            return []
+        return self.fetch_loans(search, '>=', position, limit, order=order)
+
+    def loan_matches_search(self, search, loan_id):
+        """Check whether a single record passes a search filter"""
+        return self.conn.execute(f'''
+            SELECT 1 FROM {search.source}
+            WHERE {search.clause or OPEN_LOANS} AND {search.key} = ?
+        ''', search.params + (loan_id,)).fetchone() is not None
+
+    def circulation_stats(self):
+        """(active loans, overdue loans, outstanding fines) over all open loans"""
+        return self.conn.execute('''
+            SELECT active_loans, overdue_loans, outstanding_fines FROM circulation_stats
+        ''').fetchone()
+
+    def student_stats(self, student_name):
+        """(open loans, outstanding fines) of one student"""
+        row = self.conn.execute('''
+            SELECT open_loans, outstanding_fines FROM student_stats WHERE student_name = ?
+        ''', (student_name,)).fetchone()
+        return row or (0, 0.0)
+
+    def book_stats(self, book_id):
+        """Number of copies of one book that are out"""
+        row = self.conn.execute(
+            "SELECT active_loans FROM book_stats WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_loan(self, loan_id):
+        """Fetch one record in table form, or None if it does not exist"""
+        return self.conn.execute('''
+            SELECT bb.id, bb.student_name, b.title, bb.borrow_date, bb.return_date, bb.fine,
+                   bb.book_id
+            FROM borrowed_books bb
+            JOIN books b ON bb.book_id = b.id
+            WHERE bb.id = ?
+        ''', (loan_id,)).fetchone()
+
+    def borrow(self, student_name, book_id, borrow_date, return_date, today=None):
+        """Lend a book to a student and return the new record in table form.
+
+        borrow_date and return_date are datetime.date objects.
+        """
+        return self.borrow_many(student_name, [book_id], borrow_date, return_date, today)[0]
+
+    def borrow_many(self, student_name, book_ids, borrow_date, return_date, today=None):
+        """Lend several books (a book id may repeat) to one student in one transaction.
+
+        Either every book is lent or none is. Returns the new records in table
+        form, in the order of book_ids.
+        """
+        student_name = student_name.strip()
+        today = today or date.today()
+
+        if not student_name:
+            raise LibraryError("Please enter student name")
+
+        if not book_ids:
+            raise LibraryError("Please select a book")
+
+        if borrow_date < today:
+            raise LibraryError("Borrow date cannot be in the past")
+
+        if return_date < borrow_date:
+            raise LibraryError("Return date cannot be before borrow date")
+
+        # Calculate fine
+        fine = calculate_fine(return_date, today, self.fine_rate)
+
+        def checkout(cursor):
+            loan_ids = []
+            for book_id in book_ids:
+                # Take a copy only if one is left; the check and the decrement are
+                # one statement, so two desks can never both take the last copy
+                cursor.execute('''
+                    UPDATE books SET quantity = quantity - 1 WHERE id = ? AND quantity > 0
+                ''', (book_id,))
+                if cursor.rowcount == 0:
+                    if len(book_ids) == 1:
+                        raise LibraryError("This book is no longer available")
+                    row = cursor.execute('SELECT title FROM books WHERE id = ?',
+                                         (book_id,)).fetchone()
+                    if row is None:
+                        raise LibraryError(f"Unknown book id {book_id}")
+                    raise LibraryError(f"No copies left of {row[0]}")
+
+                # Insert record
+                cursor.execute('''
+                    INSERT INTO borrowed_books
+                        (student_name, book_id, borrow_date, return_date, fine)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (student_name, book_id, borrow_date.strftime(DATE_FORMAT),
+                      return_date.strftime(DATE_FORMAT), fine))
+                loan_ids.append(cursor.lastrowid)
+            self.journal(cursor, 'borrow', [(loan_id, book_id, student_name, -1, fine)
+                                            for loan_id, book_id in zip(loan_ids, book_ids)])
+            return loan_ids
+
+        return [self.get_loan(loan_id) for loan_id in self.write(checkout)]
+
+    def open_loans(self, cursor, loan_ids):
+        """Fetch (id, book_id, return_date, student_name) of open loans; fail if any is gone"""
+        loan_ids = set(loan_ids)
+        loans = cursor.execute(f'''
+            SELECT id, book_id, return_date, student_name FROM borrowed_books
+            WHERE id IN ({', '.join('?' * len(loan_ids))}) AND returned_date IS NULL
+        ''', tuple(loan_ids)).fetchall()
+        if len(loans) != len(loan_ids):
+            # Another desk already returned or removed one of them
+            raise LibraryError("Record not found or already returned")
+        return loans
+
+    def restock(self, cursor, book_ids):
+        """Put one copy back in stock per book id (ids may repeat)"""
+        cursor.executemany('''
+            UPDATE books SET quantity = quantity + ? WHERE id = ?
+        ''', [(copies, book_id) for book_id, copies in Counter(book_ids).items()])
+
+    def delete_loans(self, loan_ids):
+        """Delete loans in one transaction, restock their books and return the book ids"""
+        def delete(cursor):
+            loans = self.open_loans(cursor, loan_ids)
+            cursor.executemany("DELETE FROM borrowed_books WHERE id = ?",
+                               [(loan_id,) for loan_id, _, _, _ in loans])
+            book_ids = [book_id for _, book_id, _, _ in loans]
+            self.restock(cursor, book_ids)
+            self.journal(cursor, 'delete', [(loan_id, book_id, student_name, 1, None)
+                                            for loan_id, book_id, _, student_name in loans])
+            return sorted(set(book_ids))
+
+        return self.write(delete)
+
+    def return_loans(self, loan_ids, today=None):
+        """Check loans back in with one transaction and return their (id, book_id, fine).
+
+        The loans are closed rather than deleted; compact_loans() later moves
+        them to the loan history.
+        """
+        today = today or date.today()
+
+        def check_in(cursor):
+            returned = []
+            students = []
+            for loan_id, book_id, return_date, student_name in self.open_loans(cursor, loan_ids):
+                # The fine is final once the book is back
+                fine = calculate_fine(datetime.strptime(return_date, DATE_FORMAT).date(),
+                                      today, self.fine_rate)
+                returned.append((loan_id, book_id, fine))
+                students.append(student_name)
+            cursor.executemany('''
+                UPDATE borrowed_books SET returned_date = ?, fine = ? WHERE id = ?
+            ''', [(today.strftime(DATE_FORMAT), fine, loan_id)
+                  for loan_id, _, fine in returned])
+            self.restock(cursor, [book_id for _, book_id, _ in returned])
+            self.journal(cursor, 'return', [(loan_id, book_id, student_name, 1, fine)
+                                            for (loan_id, book_id, fine), student_name
+                                            in zip(returned, students)])
+            return returned
+
+        return self.write(check_in)
+
+    def compact_loans(self, batch_size=COMPACT_BATCH_SIZE):
+        """Move one batch of returned loans to the loan history; returns how many moved"""
+        def compact(cursor):
+            # Both statements pick the same rows: nothing else can write in between
+            cursor.execute(f'''
+                INSERT INTO loan_history ({HISTORY_COLUMNS})
+                SELECT {HISTORY_COLUMNS} FROM borrowed_books
+                WHERE returned_date IS NOT NULL
+                ORDER BY id LIMIT ?
+            ''', (batch_size,))
+            cursor.execute('''
+                DELETE FROM borrowed_books WHERE id IN (
+                    SELECT id FROM borrowed_books
+                    WHERE returned_date IS NOT NULL
+                    ORDER BY id LIMIT ?
+                )
+            ''', (batch_size,))
+            moved = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM loan_changes
+                WHERE seq <= (SELECT MAX(seq) FROM loan_changes) - ?
+            ''', (LOAN_CHANGES_KEPT,))
+            return moved
+
+        return self.write(compact)
+
+    def recompute_fines(self, today=None):
+        """Recompute every stored fine at this service's rate"""
+        return recompute_fines(self.conn, self.fine_rate, today)
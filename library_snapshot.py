@@ -0,0 +1,306 @@
+"""Columnar in-memory snapshot of the open loans for reports.
+
+Reports filter and aggregate the same open loans over and over. Rather than a
+query and a list of row tuples per report, LoanSnapshot keeps one compact
+column per field: ids, due-date day numbers and fines in `array` columns, and
+student names and book titles dictionary-encoded as integer codes, each
+distinct string stored once. Filters and aggregates work on whole columns,
+with NumPy when it is installed and with C-level builtins otherwise.
+
+The snapshot is kept current from the loan_changes log (migration 9): every
+change to an open loan appends the loan's id under a new sequence number, so
+refresh() re-reads only the loans changed since the last number it has seen.
+A snapshot must only be used from the thread that owns its connection.
+"""
+import bisect
+import sys
+from array import array
+from collections import Counter
+from datetime import date
+from itertools import compress
+
+from library_service import LOAN_SOURCE, OPEN_LOANS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Loans are loaded this many rows per fetch
+SNAPSHOT_BATCH_SIZE = 10000
+
+# A refresh that would re-read more than this fraction of the loans reloads them all
+SNAPSHOT_RELOAD_FRACTION = 0.25
+
+# Rows of returned or deleted loans are dropped once they are this fraction of all rows
+SNAPSHOT_DEAD_FRACTION = 0.25
+
+SNAPSHOT_COLUMNS = ('bb.id, bb.student_name, b.title, bb.book_id, bb.return_date, '
+                    'IFNULL(bb.fine, 0)')
+
+# Due dates that cannot be read get this day number and are reported without a date
+NO_DAY = 0
+
+
+class Dictionary:
+    """Dictionary encoding: each distinct string is kept once and coded by its position"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """Code of value, adding it if it is new"""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def nbytes(self):
+        """Approximate memory held by the strings and their index"""
+        return (sys.getsizeof(self.values) + sys.getsizeof(self.codes)
+                + sum(sys.getsizeof(value) for value in self.values))
+
+
+class LoanSnapshot:
+    """The open loans joined with their book titles, held column by column.
+
+    Loans are kept in id order. A returned or deleted loan only has its row
+    marked dead until enough dead rows have piled up to rebuild the columns.
+    Every query takes the same optional filters: student and title (exact
+    names) and due_from/due_to (dates, inclusive).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.seq = 0
+        self.students = Dictionary()
+        self.titles = Dictionary()
+        self.day_numbers = {}
+        self.clear()
+
+    def clear(self):
+        """Drop every loan"""
+        self.ids = array('q')
+        self.student_codes = array('i')
+        self.title_codes = array('i')
+        self.book_ids = array('q')
+        self.return_days = array('i')
+        self.fines = array('d')
+        self.live = bytearray()
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.ids) - self.dead
+
+    def columns(self):
+        """Every per-row column, in the order they are filled"""
+        return (self.ids, self.student_codes, self.title_codes, self.book_ids,
+                self.return_days, self.fines, self.live)
+
+    def nbytes(self):
+        """Approximate memory held by the snapshot"""
+        return (sum(column.itemsize * len(column) for column in self.columns()[:-1])
+                + len(self.live) + self.students.nbytes() + self.titles.nbytes())
+
+    def day_number(self, iso_date):
+        """Proleptic ordinal of a stored ISO date (NO_DAY if it cannot be read)"""
+        day = self.day_numbers.get(iso_date)
+        if day is None:
+            try:
+                day = date.fromisoformat(iso_date).toordinal()
+            except (TypeError, ValueError):
+                day = NO_DAY
+            self.day_numbers[iso_date] = day
+        return day
+
+    def encode(self, row):
+        """Column values of one (id, student, title, book id, return date, fine) row"""
+        loan_id, student_name, title, book_id, return_date, fine = row
+        return (loan_id, self.students.encode(student_name), self.titles.encode(title),
+                book_id, self.day_number(return_date), fine, 1)
+
+    # Loading and refreshing
+
+    def last_seq(self):
+        """Sequence number of the latest logged change (0 if the log is empty)"""
+        return self.conn.execute("SELECT IFNULL(MAX(seq), 0) FROM loan_changes").fetchone()[0]
+
+    def load(self):
+        """Read all open loans from scratch"""
+        # Loans read after the sequence number are at least as new as it, and a
+        # change that slips in between is simply applied again by the next refresh
+        seq = self.last_seq()
+        self.students = Dictionary()
+        self.titles = Dictionary()
+        self.clear()
+        cursor = self.conn.execute(f'''
+            SELECT {SNAPSHOT_COLUMNS} FROM {LOAN_SOURCE}
+            WHERE {OPEN_LOANS} ORDER BY bb.id
+        ''')
+        for rows in iter(lambda: cursor.fetchmany(SNAPSHOT_BATCH_SIZE), []):
+            # Transpose each batch so every column is filled by one C-level extend
+            ids, student_names, titles, book_ids, return_dates, fines = zip(*rows)
+            self.ids.extend(ids)
+            self.student_codes.extend(map(self.students.encode, student_names))
+            self.title_codes.extend(map(self.titles.encode, titles))
+            self.book_ids.extend(book_ids)
+            self.return_days.extend(map(self.day_number, return_dates))
+            self.fines.extend(fines)
+        self.live = bytearray(b'\x01') * len(self.ids)
+        self.seq = seq
+        return len(self)
+
+    def refresh(self):
+        """Apply the changes logged since the last load or refresh.
+
+        Returns the number of loans re-read. A snapshot that has fallen behind
+        the pruned log, or would re-read a large part of the loans, reloads.
+        """
+        seq = self.last_seq()
+        if seq == self.seq:
+            return 0
+        first_seq = self.conn.execute("SELECT MIN(seq) FROM loan_changes").fetchone()[0]
+        changed = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT loan_id FROM loan_changes WHERE seq > ? AND seq <= ?",
+            (self.seq, seq))]
+        if (first_seq is None or first_seq > self.seq + 1
+                or len(changed) > len(self) * SNAPSHOT_RELOAD_FRACTION):
+            return self.load()
+        current = {row[0]: row for row in self.conn.execute(f'''
+            SELECT {SNAPSHOT_COLUMNS} FROM {LOAN_SOURCE}
+            WHERE {OPEN_LOANS} AND bb.id IN (
+                SELECT loan_id FROM loan_changes WHERE seq > ? AND seq <= ?
+            )
+        ''', (self.seq, seq))}
+        for loan_id in sorted(changed):
+            self.apply(loan_id, current.get(loan_id))
+        if self.dead > len(self.ids) * SNAPSHOT_DEAD_FRACTION:
+            self.drop_dead()
+        self.seq = seq
+        return len(changed)
+
+    def apply(self, loan_id, row):
+        """Bring one loan up to date; row is None once it is no longer open"""
+        index = bisect.bisect_left(self.ids, loan_id)
+        found = index < len(self.ids) and self.ids[index] == loan_id
+        if row is None:
+            if found and self.live[index]:
+                self.live[index] = 0
+                self.dead += 1
+            return
+        if found:
+            if not self.live[index]:
+                self.dead -= 1
+            for column, value in zip(self.columns(), self.encode(row)):
+                column[index] = value
+        else:
+            # New loans have the highest ids and are appended; imports may insert
+            for column, value in zip(self.columns(), self.encode(row)):
+                column.insert(index, value)
+
+    def drop_dead(self):
+        """Rebuild the columns without the rows of loans that are no longer open"""
+        live = self.live
+        for name in ('ids', 'student_codes', 'title_codes', 'book_ids', 'return_days', 'fines'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, compress(column, live)))
+        self.live = bytearray(b'\x01') * len(self.ids)
+        self.dead = 0
+
+    # Queries
+
+    def mask(self, student=None, title=None, due_from=None, due_to=None):
+        """Row selector for the filters: a NumPy bool array, or a bytearray without NumPy"""
+        ranges = []
+        if student is not None:
+            code = self.students.codes.get(student, -1)
+            ranges.append((self.student_codes, code, code))
+        if title is not None:
+            code = self.titles.codes.get(title, -1)
+            ranges.append((self.title_codes, code, code))
+        if due_from is not None or due_to is not None:
+            ranges.append((self.return_days,
+                           due_from.toordinal() if due_from else NO_DAY + 1,
+                           due_to.toordinal() if due_to else date.max.toordinal()))
+        if numpy is not None:
+            mask = numpy.frombuffer(self.live, numpy.bool_).copy()
+            for column, low, high in ranges:
+                values = numpy.frombuffer(column, column.typecode)
+                mask &= (values >= low) & (values <= high)
+            return mask
+        mask = self.live
+        for column, low, high in ranges:
+            mask = bytearray(keep and low <= value <= high for keep, value in zip(mask, column))
+        return mask
+
+    def select(self, column, mask):
+        """Values of column in the selected rows: a NumPy array or an iterator"""
+        if numpy is not None:
+            return numpy.frombuffer(column, column.typecode)[mask]
+        return compress(column, mask)
+
+    def count(self, **filters):
+        """Number of loans passing the filters"""
+        mask = self.mask(**filters)
+        return int(numpy.count_nonzero(mask)) if numpy is not None else sum(mask)
+
+    def total_fines(self, **filters):
+        """Sum of the fines of the loans passing the filters"""
+        fines = self.select(self.fines, self.mask(**filters))
+        return float(fines.sum()) if numpy is not None else sum(fines)
+
+    def overdue_ratio(self, **filters):
+        """Fraction of the loans passing the filters that are overdue (carry a fine)"""
+        fines = self.select(self.fines, self.mask(**filters))
+        if numpy is not None:
+            loans, overdue = len(fines), int(numpy.count_nonzero(fines > 0))
+        else:
+            loans = overdue = 0
+            for fine in fines:
+                loans += 1
+                overdue += fine > 0
+        return overdue / loans if loans else 0.0
+
+    def fines_by_due_date(self, bucket_days=7, **filters):
+        """List (first day, loans, fines) per bucket of bucket_days due dates, earliest first.
+
+        Buckets are aligned to day numbers, so weekly buckets start on a Sunday.
+        Loans whose due date cannot be read are counted under a first day of None.
+        """
+        mask = self.mask(**filters)
+        days = self.select(self.return_days, mask)
+        fines = self.select(self.fines, mask)
+        if numpy is not None:
+            buckets = days // bucket_days
+            if not len(buckets):
+                return []
+            low = int(buckets.min())
+            loans = numpy.bincount(buckets - low)
+            amounts = numpy.bincount(buckets - low, weights=fines)
+            totals = [(low + offset, int(loans[offset]), float(amounts[offset]))
+                      for offset in numpy.flatnonzero(loans)]
+        else:
+            sums = {}
+            for day, fine in zip(days, fines):
+                bucket = sums.setdefault(day // bucket_days, [0, 0.0])
+                bucket[0] += 1
+                bucket[1] += fine
+            totals = [(bucket, loans, amount) for bucket, (loans, amount) in sorted(sums.items())]
+        return [(date.fromordinal(bucket * bucket_days) if bucket * bucket_days > NO_DAY else None,
+                 loans, amount) for bucket, loans, amount in totals]
+
+    def loans_per_title(self, limit=None, **filters):
+        """List (title, loans) for the titles with the most loans passing the filters"""
+        codes = self.select(self.title_codes, self.mask(**filters))
+        if numpy is not None:
+            counts = numpy.bincount(codes, minlength=len(self.titles))
+            ranked = numpy.argsort(-counts, kind='stable')[:limit]
+            top = [(int(code), int(counts[code])) for code in ranked if counts[code]]
+        else:
+            top = Counter(codes).most_common(limit)
+        return [(self.titles.values[code], loans) for code, loans in top]
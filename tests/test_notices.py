@@ -0,0 +1,91 @@
+"""Interrupted notice runs resume without sending a notice twice"""
+import mailbox
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_notices import MboxSpool, write_notices
+from library_service import DATE_FORMAT, connect_database
+
+TODAY = date(2025, 6, 2)
+LOANS = 30
+BATCH_SIZE = 10
+
+
+class Killed(Exception):
+    """Stands in for the process being killed"""
+
+
+class KilledSpool(MboxSpool):
+    """An mbox spool whose run is killed once it has written some notices"""
+
+    def __init__(self, path, limit):
+        super().__init__(path)
+        self.limit = limit
+        self.written = 0
+
+    def write(self, notice, message):
+        if self.written == self.limit:
+            # What was written so far reaches the file, as it would on a kill
+            self.file.flush()
+            raise Killed
+        super().write(notice, message)
+        self.written += 1
+
+
+class WriteNoticesResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.conn = connect_database(self.path('library.db'))
+        self.addCleanup(self.conn.close)
+        with self.conn:
+            book_id = self.conn.execute(
+                "INSERT INTO books (title, quantity) VALUES ('Dune', 0)").lastrowid
+            self.conn.executemany('''
+                INSERT INTO borrowed_books (student_name, book_id, borrow_date, return_date)
+                VALUES (?, ?, ?, ?)
+            ''', [(f'Student {n}', book_id, (TODAY - timedelta(days=30)).strftime(DATE_FORMAT),
+                   (TODAY - timedelta(days=1 + n % 5)).strftime(DATE_FORMAT))
+                  for n in range(LOANS)])
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def run_notices(self, spool, checkpoint_path):
+        try:
+            return write_notices(self.conn, spool, TODAY, checkpoint_path=checkpoint_path,
+                                 batch_size=BATCH_SIZE)
+        except Killed:
+            return None
+        finally:
+            spool.close()
+
+    def loan_ids(self, mbox_path):
+        return [message['X-Library-Loan'] for message in mailbox.mbox(mbox_path)]
+
+    def check_resume(self, limit):
+        mbox_path, checkpoint_path = self.path('notices.mbox'), self.path('notices.json')
+        self.assertIsNone(self.run_notices(KilledSpool(mbox_path, limit), checkpoint_path))
+        self.assertEqual(len(self.loan_ids(mbox_path)), limit)
+
+        counts = self.run_notices(MboxSpool(mbox_path), checkpoint_path)
+        self.assertEqual(counts['overdue'], LOANS)
+        loan_ids = self.loan_ids(mbox_path)
+        self.assertEqual(len(loan_ids), LOANS)
+        self.assertEqual(len(set(loan_ids)), LOANS)
+
+    def test_killed_in_first_batch(self):
+        self.check_resume(7)
+
+    def test_killed_after_a_checkpoint(self):
+        self.check_resume(BATCH_SIZE + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
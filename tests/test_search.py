@@ -0,0 +1,88 @@
+"""Searches find the same loans in every sort order, page by page"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_service import (LOAN_ORDERS, LibraryService, LoanOrder, build_search,
+                             order_position)
+
+NAMES = ('Li', 'Li Na', 'lisa Wong', 'Wu', 'Ng', 'Nguyen', 'Thabo', 'thandi', 'Zoe', 'Emma Li')
+TITLES = ('Go', 'Go in Action', 'Gone Girl', 'The Hobbit', 'the Road', 'Python', 'Data Science')
+PAGE_SIZE = 7
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.service = LibraryService.open(os.path.join(directory.name, 'library.db'))
+        self.addCleanup(self.service.close)
+        rng = random.Random(7)
+        conn = self.service.conn
+        with conn:
+            book_ids = [conn.execute("INSERT INTO books (title, quantity) VALUES (?, 0)",
+                                     (title,)).lastrowid for title in TITLES]
+            conn.executemany('''
+                INSERT INTO borrowed_books (student_name, book_id, borrow_date, return_date, fine)
+                VALUES (?, ?, '2025-06-01', ?, ?)
+            ''', [(rng.choice(NAMES), rng.choice(book_ids), f'2025-06-{rng.randint(2, 28):02}',
+                   rng.choice((0.0, 5.0, 10.0))) for _ in range(300)])
+            conn.execute("UPDATE borrowed_books SET returned_date = '2025-06-05' WHERE id % 9 = 0")
+
+    def expected(self, text):
+        """Ids of the open loans a search should find, worked out in Python"""
+        rows = self.service.conn.execute('''
+            SELECT bb.id, bb.student_name, b.title FROM borrowed_books bb
+            JOIN books b ON bb.book_id = b.id WHERE bb.returned_date IS NULL
+        ''')
+        if len(text) < 3:
+            return {loan_id for loan_id, student_name, title in rows
+                    if student_name.lower().startswith(text) or title.lower().startswith(text)}
+        return {loan_id for loan_id, student_name, title in rows
+                if text in student_name.lower() or text in title.lower()}
+
+    def page_through(self, search, order):
+        """Read every record of a search a page at a time, as the table scrolls"""
+        records = self.service.fetch_loans_from(search, 0, PAGE_SIZE, order)
+        while records and len(records) % PAGE_SIZE == 0:
+            more = self.service.fetch_loans(search, '>', order_position(order, records[-1]),
+                                            PAGE_SIZE, order=order)
+            if not more:
+                break
+            records += more
+        return records
+
+    def test_every_order_finds_every_match(self):
+        for text in ('li', 'l', 'wu', 'ng', 'go', 'th', 'x', 'the', 'ing'):
+            search = build_search(text)
+            expected = self.expected(text)
+            self.assertEqual(self.service.count_loans(search), len(expected), text)
+            for name in LOAN_ORDERS:
+                for descending in (False, True):
+                    order = LoanOrder(name, descending)
+                    records = self.page_through(search, order)
+                    ids = [record[0] for record in records]
+                    self.assertEqual(len(ids), len(set(ids)), (text, order))
+                    self.assertEqual(set(ids), expected, (text, order))
+                    # Names and titles sort without regard to case (COLLATE NOCASE)
+                    positions = [tuple(value.lower() if isinstance(value, str) else value
+                                       for value in order_position(order, record))
+                                 for record in records]
+                    self.assertEqual(positions, sorted(positions, reverse=descending),
+                                     (text, order))
+
+    def test_single_loan_matches_short_search(self):
+        search = build_search('ng')
+        expected = self.expected('ng')
+        for (loan_id,) in self.service.conn.execute("SELECT id FROM borrowed_books"):
+            self.assertEqual(self.service.loan_matches_search(search, loan_id),
+                             loan_id in expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
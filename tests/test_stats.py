@@ -0,0 +1,93 @@
+"""The trigger-maintained statistics stay exact through every kind of change"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_service import LibraryError, LibraryService, check_stats
+
+TODAY = date(2025, 6, 2)
+STUDENTS = ('Li', 'Thabo Nkosi', 'Emma Smith', 'Ng', 'Ayanda Dlamini', 'Zoe')
+BOOKS = 12
+OPERATIONS = 1500
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.service = LibraryService.open(os.path.join(directory.name, 'library.db'))
+        self.addCleanup(self.service.close)
+        with self.service.conn:
+            self.book_ids = [self.service.conn.execute(
+                "INSERT INTO books (title, quantity) VALUES (?, ?)",
+                (f'Book {n}', 4)).lastrowid for n in range(BOOKS)]
+        self.rng = random.Random(2025)
+
+    def open_loan_ids(self):
+        return [row[0] for row in self.service.conn.execute(
+            "SELECT id FROM borrowed_books WHERE returned_date IS NULL")]
+
+    def borrow(self, service=None):
+        service = service or self.service
+        borrow_date = TODAY + timedelta(days=self.rng.randint(0, 5))
+        due = borrow_date + timedelta(days=self.rng.randint(0, 20))
+        book_ids = self.rng.choices(self.book_ids, k=self.rng.randint(1, 3))
+        return service.borrow_many(self.rng.choice(STUDENTS), book_ids, borrow_date, due,
+                                   today=TODAY)
+
+    def some_loans(self):
+        loan_ids = self.open_loan_ids()
+        return self.rng.sample(loan_ids, min(len(loan_ids), self.rng.randint(1, 4)))
+
+    def rename(self, cursor):
+        """Change a loan's student or book directly, as an edit or data fix would"""
+        loan_ids = self.open_loan_ids()
+        if not loan_ids:
+            return
+        if self.rng.random() < 0.5:
+            cursor.execute("UPDATE borrowed_books SET student_name = ? WHERE id = ?",
+                           (self.rng.choice(STUDENTS), self.rng.choice(loan_ids)))
+        else:
+            cursor.execute("UPDATE books SET title = ? WHERE id = ?",
+                           (f'Book {self.rng.random():.6f}', self.rng.choice(self.book_ids)))
+
+    def group(self):
+        """Several checkouts in one transaction; the ones that run out of copies are undone"""
+        self.service.write_group([lambda service: self.borrow(service)
+                                  for _ in range(self.rng.randint(2, 6))])
+
+    def test_mixed_operations_keep_stats_exact(self):
+        operations = [
+            (5, self.borrow),
+            (2, self.group),
+            (3, lambda: self.service.return_loans(
+                self.some_loans(), TODAY + timedelta(days=self.rng.randint(0, 40)))),
+            (1, lambda: self.service.delete_loans(self.some_loans())),
+            (1, lambda: self.service.recompute_fines(
+                TODAY + timedelta(days=self.rng.randint(0, 40)))),
+            (1, lambda: self.service.compact_loans(self.rng.randint(1, 20))),
+            (1, lambda: self.service.write(self.rename)),
+        ]
+        weights = [weight for weight, _ in operations]
+        done = 0
+        for step in range(OPERATIONS):
+            _, operation = self.rng.choices(operations, weights)[0]
+            try:
+                operation()
+                done += 1
+            except LibraryError:
+                pass  # no copies left or no loans to act on
+            if step % 100 == 0:
+                self.assertEqual(check_stats(self.service.conn), [], f"after step {step}")
+        self.assertEqual(check_stats(self.service.conn), [])
+        self.assertGreater(done, OPERATIONS // 2)
+
+
+if __name__ == '__main__':
+    unittest.main()